@@ -1,11 +1,47 @@
+import os
+
+import flask
+
 from main import app
 from layout.main import main_layout
+from plots.analysis import preload_figures
+from processing.cache import activity_cache
+from processing.prior import prior_grid
+from processing.upload import MAX_REQUEST_BYTES
 
 from callbacks import navigation  # noqa
 from callbacks import analysis  # noqa
 
+# set when the server imports the app once before forking its workers (gunicorn --preload), so the
+# heavy imports and figure skeletons are done in the master and shared copy-on-write
+PRELOAD = os.environ.get('CPZONES_PRELOAD', '') not in ('', '0')
+
 app.layout = main_layout
 server = app.server
 
+
+@server.before_request
+def limit_request_size():
+    # flask only enforces MAX_CONTENT_LENGTH on form data, dash callbacks post json
+    if (flask.request.content_length or 0) > MAX_REQUEST_BYTES:
+        flask.abort(413)
+
+
+@server.route('/stats/cache')
+def cache_stats():
+    return flask.jsonify(activity_cache.stats())
+
+
+def preload():
+    # what each worker would otherwise import or build on its first analysis request. The job pool is
+    # not started here, it is created on first use in the worker.
+    import pandas  # noqa
+    preload_figures()
+    prior_grid()
+
+
+if PRELOAD:
+    preload()
+
 if __name__ == '__main__':
     app.run_server(debug=True)
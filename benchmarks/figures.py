@@ -0,0 +1,31 @@
+import timeit
+
+import plotly.graph_objects as go
+
+from benchmarks.synthetic import synthetic_activity
+from plots import analysis
+
+
+def validated(build, plot):
+    # the previous path: build the figure with make_subplots every call and validate the data through plotly
+    def run(*args):
+        build()
+        return go.Figure(plot(*args))
+    return run
+
+
+if __name__ == '__main__':
+    data = synthetic_activity(hours=5)
+    rows = [{'duration_seconds': d, 'total_energy': d * (260 + 8000 / d)} for d in [180, 300, 600, 1200]]
+    cases = [
+        ('analysis_data_plot', analysis._analysis_data_skeleton, analysis.analysis_data_plot, (data,)),
+        ('analysis_data_histogram_plot', analysis._analysis_data_histogram_skeleton,
+         analysis.analysis_data_histogram_plot, (data.speed[:1200], data.power[:1200])),
+        ('analysis_regression_plot', analysis._analysis_regression_skeleton,
+         analysis.analysis_regression_plot, (rows, 260, 8000)),
+    ]
+    for name, build, plot, args in cases:
+        n = 20
+        before = timeit.timeit(lambda: validated(build, plot)(*args), number=n) / n
+        after = timeit.timeit(lambda: plot(*args), number=n) / n
+        print('{}: {:.1f} ms -> {:.1f} ms'.format(name, before * 1e3, after * 1e3))
@@ -0,0 +1,44 @@
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
+
+# modules the layout does not need, which should only be imported by the requests that use them
+HEAVY_MODULES = ['pandas', 'plotly.express', 'scipy', 'emcee', 'fitparse']
+REPEATS = 5
+TOP = 10
+
+
+def import_seconds(preload=False):
+    # wall time of importing the app in a fresh interpreter, as a worker starting without --preload does
+    env = dict(os.environ, CPZONES_PRELOAD='1' if preload else '0')
+    code = 'import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)'
+    output = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True)
+    return float(output.stdout.split()[-1])
+
+
+def import_profile():
+    # (cumulative microseconds, module) of every module python -X importtime reports for importing the app
+    env = dict(os.environ, CPZONES_PRELOAD='0')
+    code = 'import sys, app; print(" ".join(sorted(sys.modules)))'
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, check=True,
+                            capture_output=True, text=True)
+    rows = re.findall(r'^import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)$', output.stderr, flags=re.MULTILINE)
+    return [(int(cumulative), depth, module) for cumulative, depth, module in rows], set(output.stdout.split())
+
+
+if __name__ == '__main__':
+    # the first run fills the bytecode and prior caches
+    import_seconds(preload=True)
+    for preload in [False, True]:
+        seconds = [import_seconds(preload) for _ in range(REPEATS)]
+        print('import app{}: median {:.2f} s over {} runs'.format(' with preload' if preload else '',
+                                                                  np.median(seconds), REPEATS))
+
+    profile, modules = import_profile()
+    print('\nslowest imports below app (cumulative ms):')
+    for cumulative, depth, module in sorted(profile, reverse=True)[1:TOP + 1]:
+        print('{:8.1f}  {}{}'.format(cumulative / 1e3, depth, module))
+    print('\nheavy modules imported: {}'.format(', '.join(m for m in HEAVY_MODULES if m in modules) or 'none'))
@@ -0,0 +1,41 @@
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic import synthetic_activity
+from processing.fit import FitData, compact
+
+
+def as_lists(data):
+    # the representation parse_contents built from fitparse: lists of datetimes, floats and Nones
+    return FitData(time=data.time.astype(object).tolist(),
+                   **{field: [None if np.isnan(value) else value for value in getattr(data, field).tolist()]
+                      for field in FitData._fields[1:]})
+
+
+def as_float64(data):
+    return FitData(time=np.asarray(data.time, dtype='datetime64[s]'),
+                   **{field: np.asarray(getattr(data, field), dtype=np.float64) for field in FitData._fields[1:]})
+
+
+def retained(build, data):
+    # bytes still allocated once build has returned, that is the size of what it returned
+    tracemalloc.start()
+    result = build(data)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+if __name__ == '__main__':
+    for hours in [1, 5, 10]:
+        data = synthetic_activity(hours=hours)
+        lists = as_lists(data)
+        list_bytes = retained(as_lists, data)
+        # the array representations are built from the lists so each one is a fresh copy
+        float64_bytes = retained(as_float64, lists)
+        compact_bytes = retained(compact, lists)
+        print('{} h: lists {:.1f} MB, float64 arrays {:.2f} MB, compact arrays {:.2f} MB ({:.0f}x smaller than '
+              'lists)'.format(hours, list_bytes / 1e6, float64_bytes / 1e6, compact_bytes / 1e6,
+                              list_bytes / compact_bytes))
@@ -0,0 +1,23 @@
+import plotly.graph_objects as go
+
+from benchmarks.synthetic import synthetic_activity
+from plots.analysis import analysis_data_plot
+from plots.encoding import payload_size
+
+
+def raw_figure(data):
+    # traces as they were sent before encoding: datetimes and unrounded floats
+    figure = go.Figure()
+    for channel in ['elevation', 'speed', 'power']:
+        figure.add_trace(go.Scatter(x=data.time.astype(object), y=getattr(data, channel), mode="lines+markers"))
+    return figure
+
+
+if __name__ == '__main__':
+    for pause in [True, False]:
+        for hours in [1, 3, 6]:
+            data = synthetic_activity(hours=hours, pause=pause)
+            raw = payload_size(raw_figure(data))
+            encoded = payload_size(analysis_data_plot(data))
+            print('{} h{}: raw {:.2f} MB, encoded {:.2f} MB ({:.0%})'.format(
+                hours, ' with pause' if pause else '', raw / 1e6, encoded / 1e6, encoded / raw))
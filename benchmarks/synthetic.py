@@ -0,0 +1,23 @@
+import numpy as np
+
+from processing.fit import FitData
+
+
+def synthetic_activity(hours=5, seed=0, pause=True):
+    # 1 Hz running activity with a slowly varying effort, occasional sensor dropouts and a pause
+    rng = np.random.default_rng(seed)
+    n = int(hours * 3600)
+    seconds = np.arange(n)
+    if pause:
+        seconds[n // 2:] += 300
+    time = np.datetime64('2020-06-01T07:00:00') + seconds.astype('timedelta64[s]')
+    effort = 1 + 0.15 * np.sin(seconds / 600) + 0.1 * (np.sin(seconds / 97) > 0.8)
+    speed = 3.2 * effort + rng.normal(0, 0.05, n)
+    power = np.round(260 * effort + rng.normal(0, 8, n))
+    power[rng.random(n) < 0.01] = np.nan
+    distance = np.cumsum(speed)
+    elevation = 50 + 10 * np.sin(distance / 2000)
+    latitude = 51.5 + np.cumsum(rng.normal(0, 1e-5, n))
+    longitude = -0.1 + np.cumsum(rng.normal(0, 1e-5, n))
+    return FitData(time=time, distance=np.round(distance, 2), speed=speed * 3.6, power=power,
+                   elevation=np.round(elevation * 5) / 5, latitude=latitude, longitude=longitude)
@@ -1,85 +1,136 @@
-import io
-import base64
-
+import dash
 import numpy as np
-import pandas as pd
 import dash_table
 
 import dash_core_components as dcc
+import dash_html_components as html
 import dash_bootstrap_components as dbc
 
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
 from app import app
 from plots.analysis import analysis_data_plot, analysis_plot_config, analysis_data_histogram_plot, analysis_regression_plot
 
-from fitparse import FitFile
-from collections import namedtuple
+from processing.upload import decode_upload
+from processing.cache import content_key
+from processing.store import activity_store
+from processing.activity import load_activity, parse_activity
+from processing.jobs import job_runner, parse_runner, PENDING, RUNNING, DONE, FAILED
+from processing.intervals import (IntervalIndex, build_interval_index, interval_stats, is_autorange, relayout_range,
+                                  selection_indices)
+from processing.models import fit_table
+from processing.wprime_balance import wprime_balance
+from processing.time_in_zone import activity_zones
+from processing.sampler import DEFAULT_BOUNDS, sample_summary
+from processing.prior import race_bounds, race_prior
+from processing.power_curve import best_efforts
+from processing.segmentation import detect_intervals
+from processing.resample import Gaps
+from processing.critical_power import DEFAULT_PRIOR, create_power_zones, credible_interval
 
 from dash_table.Format import Format
 
-FitData = namedtuple('FitData', ['time', 'distance', 'speed', 'power', 'elevation', 'latitude', 'longitude'])
-
 
 def parse_contents(contents, filename):
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+    # returns the activity key with its data if it was parsed before, otherwise with the buffer to parse
     try:
-        if 'fit' in filename.split('.')[1]:
-            fit_file = FitFile(io.BytesIO(decoded))
-            time = []
-            distance = []
-            speed = []
-            power = []
-            elevation = []
-            latitude = []
-            longitude = []
-            for record in fit_file.get_messages('record'):
-                values = record.get_values()
-                time.append(values.get('timestamp', None))
-                distance.append(values.get('distance', None))
-                speed.append(values.get('enhanced_speed', None))
-                elevation.append(values.get('enhanced_altitude', None))
-                latitude.append(values.get('position_lat', None))
-                longitude.append(values.get('position_long', None))
-                power.append(values.get('power', None))
-
-            speed_kph = [i * 3.6 if i is not None else None for i in speed]
-            latitude_degrees = [i * (180 / 2 ** 31) if i is not None else None for i in latitude]
-            longitude_degrees = [i * (180 / 2 ** 31) if i is not None else None for i in longitude]
-            data = FitData(time=time, distance=distance, speed=speed_kph, power=power, elevation=elevation,
-                           latitude=latitude_degrees, longitude=longitude_degrees)
-        else:
-            return None
+        buffer = decode_upload(contents, filename)
+        key = content_key(buffer)
+        data = load_activity(key)
     except Exception as e:
         print(e)
-        return None
-    return data
+        return None, None, None
+    return key, data, buffer
+
+
+def analysis_data_object(data):
+    figure = analysis_data_plot(analysis_data=data)
+    return html.Div([
+        dbc.Button("Use best efforts", id='best_efforts_btn', color="primary", size="sm", outline=True,
+                   className='mt-2'),
+        dbc.Button("Find intervals", id='detect_intervals_btn', color="primary", size="sm", outline=True,
+                   className='mt-2 ml-2'),
+        dcc.Graph(figure=figure, config=analysis_plot_config, id='plot_analysis_data')
+    ])
+
+
+def job_progress(job, label):
+    return dbc.Progress("{} {:.0f}%".format(label, 100 * job.progress), value=100 * job.progress, striped=True,
+                        animated=True, className='mt-2')
 
 
 @app.callback(
     [
         Output('loading_power_data', 'children'),
-        Output('hidden_data', 'value')
+        Output('hidden_data', 'value'),
+        Output('parse_job', 'data'),
+        Output('parse_poll', 'disabled')
     ],
     [
-        Input('upload-data', 'contents')
+        Input('upload-data', 'contents'),
+        Input('parse_poll', 'n_intervals')
     ],
     [
-        State('upload-data', 'filename')
+        State('upload-data', 'filename'),
+        State('parse_job', 'data')
     ])
-def update_output_regression(file_contents, file_name):
+def update_output_regression(file_contents, n_intervals, file_name, job_id):
     error_message = dbc.Alert("There was an error processing this file.", color="danger")
-    if file_contents is not None:
-        data = parse_contents(file_contents, file_name)
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+
+    if 'parse_poll.n_intervals' not in triggered:
+        if job_id:
+            parse_runner.cancel(job_id)
+        if file_contents is None:
+            return None, None, None, True
+        key, data, buffer = parse_contents(file_contents, file_name)
         if data:
-            figure = analysis_data_plot(analysis_data=data)
-            plot_object = dcc.Graph(figure=figure, config=analysis_plot_config, id='plot_analysis_data')
-            return plot_object, data._asdict()
-        else:
-            return error_message, None
-    else:
-        return None, None
+            return analysis_data_object(data), key, None, True
+        if key is None:
+            return error_message, None, None, True
+        # parse new files in the job pool, the interval polls until the job has finished
+        job_id = parse_runner.submit(parse_activity, bytes(buffer), key)
+        return None, None, job_id, False
+
+    job = parse_runner.status(job_id) if job_id else None
+    if job is None:
+        return dash.no_update, dash.no_update, None, True
+    if job.status in (PENDING, RUNNING):
+        return job_progress(job, "Reading file"), dash.no_update, job_id, False
+    if job.status == DONE:
+        key = parse_runner.result(job_id)
+        data = load_activity(key)
+        if data:
+            return analysis_data_object(data), key, None, True
+    print(job.error)
+    return error_message, None, None, True
+
+
+@app.callback(
+    Output('plot_analysis_data', 'figure'),
+    [
+        Input('plot_analysis_data', 'relayoutData'),
+        Input('analysis_params', 'data')
+    ],
+    [
+        State('hidden_data', 'value')
+    ])
+def zoom_analysis_data(relayout_data, analysis_params, key):
+    # re-render the visible window at full resolution when zooming, and the whole activity on reset;
+    # once critical power is known the W' balance row is filled in
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    window = relayout_range(relayout_data)
+    if 'analysis_params.data' not in triggered and window is None and not is_autorange(relayout_data):
+        raise PreventUpdate
+    data = activity_store.get(key) if key else None
+    if data is None:
+        raise PreventUpdate
+    balance = None
+    if analysis_params and analysis_params['key'] == key:
+        index = activity_store.get(key, IntervalIndex) or build_interval_index(data)
+        balance = wprime_balance(index.seconds, data.power, analysis_params['cp'], analysis_params['wprime'])
+    return analysis_data_plot(analysis_data=data, window=window, wprime_balance=balance)
 
 
 @app.callback(
@@ -93,49 +144,44 @@ def update_output_regression(file_contents, file_name):
         Output('analysis_message_monotonic', 'children')
     ],
     [
-        Input('plot_analysis_data', 'selectedData')
+        Input('plot_analysis_data', 'selectedData'),
+        Input('best_efforts_btn', 'n_clicks'),
+        Input('detect_intervals_btn', 'n_clicks')
     ],
     [
-        State('plot_analysis_data', 'figure'),
+        State('hidden_data', 'value'),
         State('selected_data_table', 'data'),
     ])
-def display_selected_data(selected_data, figure, rows):
+def display_selected_data(selected_data, best_efforts_clicks, detect_intervals_clicks, key, rows):
     histogram = None
     data_is_monotonic = False
 
-    if selected_data and figure:
-        index = [point['pointIndex'] for point in selected_data['points']]
-
-        if index:
-            time = [value for i, value in enumerate(figure['data'][0]['x']) if i in index]
-            speed = [value for i, value in enumerate(figure['data'][1]['y']) if i in index]
-            power = [value for i, value in enumerate(figure['data'][2]['y']) if i in index]
-
-            datetime = pd.to_datetime(pd.Series(time))
-            interval_start = datetime.min()
-            interval_end = datetime.max()
-            interval = (interval_end - interval_start).total_seconds()
-            mean_speed = np.mean(speed)
-            mean_power = np.mean(power)
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    data = activity_store.get(key) if key else None
+    if data:
+        index = activity_store.get(key, IntervalIndex) or build_interval_index(data)
 
-            # compute corrected power which produces the total energy during this period
-            time_delta = [x.total_seconds() for x in datetime.diff()]
-            total_energy = np.nansum(np.array(time_delta) * np.array(power))
+        if 'best_efforts_btn.n_clicks' in triggered and best_efforts_clicks:
+            rows = [interval_stats(data, index, start, stop) for start, stop in best_efforts(index)]
+        elif 'detect_intervals_btn.n_clicks' in triggered and detect_intervals_clicks:
+            gaps = activity_store.get(key, Gaps)
+            rows = [interval_stats(data, index, start, stop) for start, stop in detect_intervals(data, index, gaps)]
+        elif selected_data:
+            start, stop = selection_indices(selected_data, data.time)
 
-            row = {'interval_start': interval_start,
-                   'interval_end': interval_end,
-                   'duration_seconds': interval,
-                   'average_speed': mean_speed,
-                   'average_power': mean_power,
-                   'total_energy': total_energy}
+            # an interval needs two samples to have a duration
+            if stop - start > 1:
+                rows.append(interval_stats(data, index, start, stop))
 
-            rows.append(row)
+                figure = analysis_data_histogram_plot(data.speed[start:stop], data.power[start:stop])
+                histogram = dcc.Graph(figure=figure, id='histogram_plot', config={'displayModeBar': False})
 
-            figure = analysis_data_histogram_plot(speed, power)
-            histogram = dcc.Graph(figure=figure, id='histogram_plot', config={'displayModeBar': False})
-
-            data_is_monotonic = pd.DataFrame(rows).sort_values(by='duration_seconds')[
-                'average_power'].is_monotonic_decreasing
+        if rows:
+            # values missing from a selection without power come back from the browser as None
+            duration = np.array([row['duration_seconds'] for row in rows], dtype=np.float64)
+            power = np.array([row['average_power'] for row in rows], dtype=np.float64)
+            power = power[np.argsort(duration, kind='stable')]
+            data_is_monotonic = bool(not np.isnan(power).any() and np.all(np.diff(power) <= 0))
 
     number_message = None if len(rows) > 2 else dbc.Alert("Select a minimum of 3 intervals.", color="warning")
     monotonic_message = None if data_is_monotonic else dbc.Alert("Power must decrease with increasing duration.",
@@ -147,57 +193,136 @@ def display_selected_data(selected_data, figure, rows):
     return rows, disabled_btn, disabled_color, histogram, open_container, number_message, monotonic_message
 
 
-def create_power_zones(selected_data, data):
-    select_data_df = pd.DataFrame(selected_data)
-    coef = np.polyfit(select_data_df.duration_seconds,  select_data_df.total_energy, 1)
-    cp = coef[0]
-    wprime = coef[1]
-    power_zones_df = pd.DataFrame({
-        'zone': ['Z1', 'Z2', 'Z3', 'Z4', 'Z5'],
-        'lower power': [cp * x for x in [0.65, 0.80, 0.9, 1, 1.15]],
-        'upper power': [cp * x for x in [0.80, 0.9, 1, 1.15, 3]],
-        'description': ['Easy', 'Moderate', 'Threshold', 'Interval', 'Repetition']
-    })
-    return power_zones_df, cp, wprime
-
-
 @app.callback(
     [
         Output('analysis_output', 'children'),
         Output("analysis_results_container", "is_open"),
         Output('analysis_regression', 'children'),
         Output("cp_value", "children"),
-        Output("wprime_value", "children")
+        Output("wprime_value", "children"),
+        Output("cp_interval", "children"),
+        Output("wprime_interval", "children"),
+        Output('analysis_params', 'data'),
+        Output('sampler_output', 'children'),
+        Output('sampler_job', 'data'),
+        Output('sampler_poll', 'disabled')
     ],
     [
-        Input('analysis_btn', 'n_clicks')
+        Input('analysis_btn', 'n_clicks'),
+        Input('sampler_poll', 'n_intervals')
     ],
     [
         State("selected_data_table", "data"),
-        State('hidden_data', 'value')
+        State('hidden_data', 'value'),
+        State('sampler_job', 'data'),
+        State('athlete_weight', 'value'),
+        State('race_distance', 'value'),
+        State('race_time', 'value'),
+        State('model_select', 'value')
     ])
-def display_analysis_output(n_clicks, selected_data, data):
+def display_analysis_output(n_clicks, n_intervals, selected_data, key, job_id, weight, race_distance, race_time,
+                            model):
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if 'sampler_poll.n_intervals' in triggered:
+        return (dash.no_update,) * 8 + sampler_status(job_id)
+
+    if job_id:
+        job_runner.cancel(job_id)
     if n_clicks:
+        data = activity_store.get(key)
 
-        power_zones_df, cp, wprime = create_power_zones(selected_data, data)
+        prior, bounds = DEFAULT_PRIOR, DEFAULT_BOUNDS
+        if weight and race_distance and race_time:
+            prior = race_prior(weight, race_distance, race_time * 60)
+            bounds = race_bounds(weight, race_distance, race_time * 60)
 
-        figure = analysis_regression_plot(selected_data, cp, wprime)
+        power_zones_df, cp, wprime, posterior, selection = create_power_zones(selected_data, data, prior,
+                                                                              model or 'linear')
+        if data:
+            power_zones_df = activity_zones(power_zones_df, data, cp)
+
+        figure = analysis_regression_plot(selected_data, cp, wprime, selection)
         # regression = dcc.Graph(figure=figure, id='regression_plot', config={'displayModeBar': False})
         regression = dcc.Graph(figure=figure, id='regression_plot')
 
         analysis_output = dash_table.DataTable(
             id='power_zones_table',
             columns=[
-                {'id': 'zone', 'name': 'zone'},
-                {'id': 'lower power', 'name': 'lower power (watts)', 'type': 'numeric',
+                {'id': 'zone', 'name': ['', 'zone']},
+                {'id': 'lower power', 'name': ['lower power (watts)', 'mean'], 'type': 'numeric',
+                 'format': Format(precision=3)},
+                {'id': 'lower power 5%', 'name': ['lower power (watts)', '5%'], 'type': 'numeric',
+                 'format': Format(precision=3)},
+                {'id': 'lower power 95%', 'name': ['lower power (watts)', '95%'], 'type': 'numeric',
+                 'format': Format(precision=3)},
+                {'id': 'upper power', 'name': ['upper power (watts)', 'mean'], 'type': 'numeric',
+                 'format': Format(precision=3)},
+                {'id': 'upper power 5%', 'name': ['upper power (watts)', '5%'], 'type': 'numeric',
                  'format': Format(precision=3)},
-                {'id': 'upper power', 'name': 'upper power (watts)', 'type': 'numeric',
+                {'id': 'upper power 95%', 'name': ['upper power (watts)', '95%'], 'type': 'numeric',
                  'format': Format(precision=3)},
-                {'id': 'description', 'name': 'description'},
+                {'id': 'time in zone', 'name': ['this activity', 'time (min)'], 'type': 'numeric',
+                 'format': Format(precision=3)},
+                {'id': 'energy in zone', 'name': ['this activity', 'energy (kJ)'], 'type': 'numeric',
+                 'format': Format(precision=3)},
+                {'id': 'average speed in zone', 'name': ['this activity', 'speed (km/h)'], 'type': 'numeric',
+                 'format': Format(precision=3)},
+                {'id': 'description', 'name': ['', 'description']},
             ],
             data=power_zones_df.to_dict('records'),
+            merge_duplicate_headers=True,
+            style_header={'fontWeight': 'bold'},
+        )
+        models_table = dash_table.DataTable(
+            id='model_fits_table',
+            columns=[
+                {'id': 'model', 'name': 'model'},
+                {'id': 'cp', 'name': 'critical power (watts)', 'type': 'numeric', 'format': Format(precision=3)},
+                {'id': 'wprime', 'name': "W' (joules)", 'type': 'numeric', 'format': Format(precision=4)},
+                {'id': 'pmax', 'name': 'maximum power (watts)', 'type': 'numeric', 'format': Format(precision=4)},
+                {'id': 'rss', 'name': 'RSS', 'type': 'numeric', 'format': Format(precision=3)},
+                {'id': 'aicc', 'name': 'AICc', 'type': 'numeric', 'format': Format(precision=3)},
+                {'id': 'bic', 'name': 'BIC', 'type': 'numeric', 'format': Format(precision=3)},
+            ],
+            data=fit_table(selection.fits),
             style_header={'fontWeight': 'bold'},
+            style_data_conditional=[{'if': {'filter_query': '{{model}} = "{}"'.format(selection.model)},
+                                     'fontWeight': 'bold'}],
         )
-        return analysis_output, True, regression, np.round(cp), np.round(wprime)
+        analysis_output = html.Div([analysis_output, html.Div(models_table, className='mt-3')])
+        # only the linear model has a prior, the others give confidence intervals
+        interval = "90% credible interval" if selection.model == 'linear' else "90% confidence interval"
+        cp_interval = interval + " {:.0f} to {:.0f}".format(*credible_interval(posterior.cp, posterior.cp_sd))
+        wprime_interval = interval + " {:.0f} to {:.0f}".format(
+            *credible_interval(posterior.wprime, posterior.wprime_sd))
+
+        analysis_params = {'key': key, 'cp': float(cp), 'wprime': float(wprime)}
+        if selection.model != 'linear':
+            return (analysis_output, True, regression, np.round(cp), np.round(wprime), cp_interval, wprime_interval,
+                    analysis_params, None, None, True)
+        # check the closed-form interval against the full posterior, sampled in the job pool
+        job_id = job_runner.submit(sample_summary, np.array([row['duration_seconds'] for row in selected_data]),
+                                   np.array([row['total_energy'] for row in selected_data]), bounds)
+        return (analysis_output, True, regression, np.round(cp), np.round(wprime), cp_interval, wprime_interval,
+                analysis_params, None, job_id, False)
     else:
-        return None, False, None, None, None
+        return None, False, None, None, None, None, None, None, None, None, True
+
+
+def sampler_status(job_id):
+    job = job_runner.status(job_id) if job_id else None
+    if job is None:
+        return None, None, True
+    if job.status in (PENDING, RUNNING):
+        return job_progress(job, "Sampling posterior"), job_id, False
+    if job.status == DONE:
+        summary = job_runner.result(job_id)
+        message = ("Sampled 90% credible intervals: critical power {:.0f} to {:.0f} watts, "
+                   "W' {:.0f} to {:.0f} joules.").format(summary.cp[0], summary.cp[2],
+                                                         summary.wprime[0], summary.wprime[2])
+        if not summary.converged:
+            message += " The sampler did not converge."
+        return html.Small(message, className='text-muted'), None, True
+    if job.status == FAILED:
+        print(job.error)
+    return None, None, True
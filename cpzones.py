@@ -0,0 +1,146 @@
+import sys
+import csv
+import json
+import argparse
+
+import numpy as np
+
+from processing.batch import (envelope_intervals, file_power_zones, map_files, power_curves, read_activity,
+                              season_envelope)
+from processing.critical_power import DEFAULT_PRIOR, create_power_zones, credible_interval
+from processing.models import MODELS
+from processing.power_curve import FIT_DURATIONS
+from processing.prior import race_prior
+from processing.time_in_zone import ZONE_NAMES, weekly_zone_distribution
+
+
+def parse_durations(value):
+    return [int(duration) for duration in value.split(',')]
+
+
+def parse_race(value):
+    # "70,10000,2520" -> Prior from a 70 kg athlete's 10 km in 42 minutes
+    weight, distance, time = [float(part) for part in value.split(',')]
+    return race_prior(weight, distance, time)
+
+
+def parse_intervals(value):
+    # "300-480,900-1200" -> [(300, 480), (900, 1200)], seconds from the start of the activity
+    intervals = []
+    for interval in value.split(','):
+        start, end = interval.split('-')
+        intervals.append((float(start), float(end)))
+    return intervals
+
+
+def result_row(result):
+    posterior = result['posterior']
+    cp_lower, cp_upper = credible_interval(posterior.cp, posterior.cp_sd)
+    wprime_lower, wprime_upper = credible_interval(posterior.wprime, posterior.wprime_sd)
+    row = {'file': result['file'], 'start': result['start'], 'model': result['model'],
+           'cp': result['cp'], 'cp 5%': cp_lower, 'cp 95%': cp_upper,
+           'wprime': result['wprime'], 'wprime 5%': wprime_lower, 'wprime 95%': wprime_upper}
+    for zone in result['zones'].to_dict('records'):
+        row['{} lower'.format(zone['zone'])] = zone['lower power']
+        row['{} upper'.format(zone['zone'])] = zone['upper power']
+    return row
+
+
+class RowWriter:
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        self.writer = None
+
+    def write(self, row):
+        # NaN, as a standard deviation without enough intervals or the speed in a zone with no time, is not json
+        row = {name: None if isinstance(value, float) and not np.isfinite(value) else value
+               for name, value in row.items()}
+        if self.output_format == 'csv':
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.stream, fieldnames=list(row))
+                self.writer.writeheader()
+            self.writer.writerow(row)
+        else:
+            self.stream.write(json.dumps(row) + '\n')
+        self.stream.flush()
+
+
+def since_weeks(weeks):
+    return np.datetime64('now', 's') - np.timedelta64(7 * weeks, 'D') if weeks else None
+
+
+def season_result(paths, args, failed=None):
+    since = since_weeks(args.weeks)
+    envelope = season_envelope(power_curves(paths, processes=args.jobs, failed=failed), since=since)
+    rows = envelope_intervals(envelope, args.durations)
+    if len(rows) < 2:
+        raise ValueError('not enough best efforts to fit critical power')
+    power_zones_df, cp, wprime, posterior, selection = create_power_zones(rows, prior=args.race, model=args.model)
+    return {'file': 'season', 'start': str(since) if since is not None else '', 'model': selection.model,
+            'cp': cp, 'wprime': wprime, 'posterior': posterior, 'zones': power_zones_df}
+
+
+def weekly_rows(paths, cp, args, failed=None):
+    # time, energy and average speed in each zone of cp for every week, all activities binned at once
+    since = since_weeks(args.weeks)
+    activities = [activity for activity in map_files(read_activity, paths, processes=args.jobs, failed=failed)
+                  if len(activity.time) and (since is None or activity.time[0] >= since)]
+    if not activities:
+        return
+    weeks, distribution = weekly_zone_distribution(activities, cp)
+    for i, week in enumerate(weeks):
+        row = {'week': str(week), 'cp': cp}
+        for j, zone in enumerate(ZONE_NAMES):
+            row['{} time (s)'.format(zone)] = distribution.time[i, j]
+            row['{} energy (J)'.format(zone)] = distribution.energy[i, j]
+            row['{} speed (km/h)'.format(zone)] = distribution.speed[i, j]
+        yield row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cpzones',
+                                     description="Critical power, W' and power zones from .fit files.")
+    parser.add_argument('files', nargs='+', help='.fit files')
+    parser.add_argument('--durations', type=parse_durations, default=FIT_DURATIONS,
+                        help='best effort durations (s) to fit, comma separated (default: %(default)s)')
+    parser.add_argument('--intervals', type=parse_intervals,
+                        help='fit to these intervals instead of best efforts, e.g. 300-480,900-1200 (s)')
+    parser.add_argument('--season', action='store_true',
+                        help='fit once to the best efforts across all files instead of per file')
+    parser.add_argument('--weeks', type=int, help='with --season, only use activities from the last N weeks')
+    parser.add_argument('--weekly', action='store_true',
+                        help="with --season, write the time, energy and speed in each of the season's zones per week")
+    parser.add_argument('--race', type=parse_race, default=DEFAULT_PRIOR, metavar='WEIGHT,DISTANCE,TIME',
+                        help='prior for critical power from a race result in kg, m and s, e.g. 70,10000,2520')
+    parser.add_argument('--model', choices=MODELS + ['best'], default='linear',
+                        help='power-duration model to fit, best for the one with the lowest AICc (default: linear, '
+                             'the only one using the --race prior)')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: number of cores)')
+    args = parser.parse_args(argv)
+
+    writer = RowWriter(sys.stdout, args.format)
+    # files that could not be read are skipped, and make the exit status non-zero once the rest are written
+    failed = []
+    if args.season:
+        try:
+            result = season_result(args.files, args, failed)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        if args.weekly:
+            for row in weekly_rows(args.files, result['cp'], args, failed):
+                writer.write(row)
+        else:
+            writer.write(result_row(result))
+    else:
+        for result in map_files(file_power_zones, args.files, args.durations, args.intervals, args.model,
+                                args.race, processes=args.jobs, failed=failed):
+            writer.write(result_row(result))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+# run from the repository root with python -m examples.cp_prior, so the processing package can be imported
 import numpy as np
 
 race_weight = 70
@@ -20,3 +21,9 @@ power_ftp_lower = (min(c) * min(velocity_at_ftp) * race_weight) + (
 
 print(f'lower ftp {np.round(power_ftp_lower)} upper ftp {np.round(power_ftp_upper)}')
 print(f'range ftp {power_ftp_upper - power_ftp_lower}')
+
+# the same calculation over the whole parameter ranges, as used by the app and cli
+from processing.prior import race_bounds, race_prior
+
+print(race_prior(race_weight, race_distance, race_time))
+print(race_bounds(race_weight, race_distance, race_time))
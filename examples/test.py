@@ -1,3 +1,4 @@
+# run from the repository root with python -m examples.test, so the processing package can be imported
 import numpy as np
 
 # prior information
@@ -34,57 +35,26 @@ power_ftp_truth = (power_ftp_upper + power_ftp_lower) / 2
 
 np.array([race_power_lower, race_power_upper]) * race_time - (power_ftp_upper * race_time)
 
-# linear regression
 from scipy.stats import norm
 
-
-def log_prior(xs):
-    theta0, theta1 = xs
-    if ((theta0 > wprime_l) and (theta0 < wprime_u)) and ((theta1 > power_ftp_lower) and (theta1 < power_ftp_upper)):
-        return 0
-    else:
-        return -np.inf
-
-
-def log_likelihood(xs, data):
-    theta0, theta1 = xs
-    xobs, yobs, eobs = data
-    model = theta0 + theta1 * xobs
-    diff = model - yobs
-    return norm.logpdf(diff / eobs).sum()
-
-
-def log_posterior(xs, data):
-    prior = log_prior(xs)
-    if not np.isfinite(prior):
-        return prior
-    return prior + log_likelihood(xs, data)
-
-
-import emcee
-
-ndim = 2  # How many parameters we are fitting. This is our dimensionality.
-nwalkers = 2 * ndim  # Keep this well above your dimensionality.
-
-p0 = np.random.uniform(low=[wprime_l, power_ftp_lower], high=[wprime_u, power_ftp_upper], size=(nwalkers, ndim))
+from processing.sampler import Bounds, sample_critical_power
 
 xs = np.array([120, 600, 1200])
 ys = np.array([15000, 21000, 25000]) + np.array([250, 350, 260]) * xs
-err = ys * 0.05 * np.ones(len(xs))
 
 # xs = np.array([120])
 # ys = np.array([21000]) + np.array([276]) * xs
-# err = ys * 0.1 * np.ones(len(xs))
 
 # xs = np.array([120, 600])
 # ys = np.array([21000, 21000]) + np.array([276, 276]) * xs
-# err = ys * 0.1 * np.ones(len(xs))
 
-# Start points
-sampler = emcee.EnsembleSampler(nwalkers, ndim, log_posterior, args=[(xs, ys, err)])
-state = sampler.run_mcmc(p0, 4000)  # Tell each walker to take 4000 steps
-chain = sampler.chain[:, 200:, :]  # Throw out the first 200 steps
-flat_chain = chain.reshape((-1, ndim))  # Stack the steps from each walker
+prior_bounds = Bounds(cp_lower=power_ftp_lower, cp_upper=power_ftp_upper, wprime_lower=wprime_l,
+                      wprime_upper=wprime_u)
+result = sample_critical_power(xs, ys, bounds=prior_bounds)
+print(f'autocorrelation time {result.autocorrelation_time} effective samples {result.effective_samples} '
+      f'r hat {result.r_hat} converged {result.converged}')
+flat_chain = result.samples[:, ::-1]  # columns of (wprime, cp)
+err = ys * 0.05 * np.ones(len(xs))
 
 import matplotlib.pyplot as plt
 
@@ -93,7 +63,6 @@ from chainconsumer import ChainConsumer
 plt.figure()
 c = ChainConsumer()
 c.add_chain(flat_chain, parameters=[r"$\theta_0$", r"$\theta_1$"], color="b")
-c.add_chain(sampler.chain.reshape((-1, ndim)), color="r")
 c.plotter.plot_walks(figsize=(8, 4))
 
 plt.show()
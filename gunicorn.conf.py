@@ -0,0 +1,44 @@
+import os
+import multiprocessing
+
+# Production settings for gunicorn app:server, read from this file when gunicorn starts in this directory.
+# Each setting can be overridden on the command line.
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8050'))
+
+# Threaded workers, so a slow upload or analysis request only holds one thread. Callbacks are mostly numpy,
+# which releases the GIL, and sampling runs in each worker's job pool rather than in a request thread.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('CPZONES_THREADS', 4))
+
+# one sampling process per worker unless set, the pools of all workers share the host's cores. Uploads are
+# parsed in a separate pool of CPZONES_PARSE_WORKERS processes, so they do not queue behind sampling.
+os.environ.setdefault('CPZONES_JOB_WORKERS', '1')
+
+# Uploads reach the server as one json callback request holding the file as base64, limited by
+# MAX_REQUEST_BYTES in app.py. These limits only cover the request line and headers.
+limit_request_line = 4094
+limit_request_fields = 100
+limit_request_field_size = 8190
+
+# A 32 MB upload can take a while on a slow connection. Parsing and sampling run as jobs that the page polls
+# for, so no single request needs to run for long.
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# recycle workers to bound the memory of long running processes, staggered so they do not all restart at once
+max_requests = 1000
+max_requests_jitter = 100
+
+# import the app and build its figures and prior once in the master, so new workers, including those
+# replacing recycled ones, fork with them loaded
+preload_app = True
+os.environ.setdefault('CPZONES_PRELOAD', '1')
+
+# the heartbeat file is touched every second, keep it off disk in containers where /tmp may be one
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = '-'
@@ -5,6 +5,10 @@ import dash_bootstrap_components as dbc
 
 from dash_table.Format import Format
 
+from processing.models import MODELS
+from processing.prior import GRID_DISTANCES, GRID_TIMES, GRID_WEIGHTS
+from processing.upload import MAX_UPLOAD_BYTES
+
 analysis_layout = [
     dcc.Upload(
         id='upload-data',
@@ -23,7 +27,8 @@ analysis_layout = [
             'margin': '10px'
         },
         # Allow multiple files to be uploaded
-        multiple=False
+        multiple=False,
+        max_size=MAX_UPLOAD_BYTES
     ),
     dbc.Row(
         dbc.Col(
@@ -79,6 +84,58 @@ analysis_layout = [
                     dbc.Col(id="analysis_message_monotonic", md=12)
                 ]
             ),
+            dbc.Row(
+                children=[
+                    dbc.Col(
+                        dbc.InputGroup([
+                            dbc.InputGroupAddon("model", addon_type="prepend"),
+                            dbc.Select(id='model_select', value='linear', options=[
+                                {'label': 'linear work-time', 'value': 'linear'},
+                                {'label': 'lowest AICc', 'value': 'best'}] + [
+                                {'label': model.replace('_', ' '), 'value': model} for model in MODELS[1:]])
+                        ]),
+                        md=4
+                    ),
+                    dbc.Col(
+                        html.Small("The zones use the linear work-time model, the only one with a prior on critical "
+                                   "power, unless another model is chosen.", className='text-muted'),
+                        md=8
+                    )
+                ],
+                className='mb-3'
+            ),
+            dbc.Row(
+                children=[
+                    dbc.Col(
+                        dbc.InputGroup([
+                            dbc.InputGroupAddon("weight (kg)", addon_type="prepend"),
+                            dbc.Input(id='athlete_weight', type='number', min=GRID_WEIGHTS[0], max=GRID_WEIGHTS[-1])
+                        ]),
+                        md=4
+                    ),
+                    dbc.Col(
+                        dbc.InputGroup([
+                            dbc.InputGroupAddon("race distance (m)", addon_type="prepend"),
+                            dbc.Input(id='race_distance', type='number', min=GRID_DISTANCES[0],
+                                      max=GRID_DISTANCES[-1])
+                        ]),
+                        md=4
+                    ),
+                    dbc.Col(
+                        dbc.InputGroup([
+                            dbc.InputGroupAddon("race time (min)", addon_type="prepend"),
+                            dbc.Input(id='race_time', type='number', min=GRID_TIMES[0] / 60, max=GRID_TIMES[-1] / 60)
+                        ]),
+                        md=4
+                    ),
+                    dbc.Col(
+                        html.Small("Optional: a recent race result gives a prior for critical power.",
+                                   className='text-muted'),
+                        md=12
+                    )
+                ],
+                className='mb-3'
+            ),
             dbc.Row(
                 children=[
                     dbc.Col(md=6),
@@ -106,7 +163,7 @@ analysis_layout = [
                     dbc.Col(
                         children=[
                             dbc.Toast(
-                                [html.H1(id='cp_value')],
+                                [html.H1(id='cp_value'), html.Small(id='cp_interval')],
                                 header="Critical Power (watts)",
                                 style={'max-width': '100%'}
                             )
@@ -115,7 +172,7 @@ analysis_layout = [
                     dbc.Col(
                         children=[
                             dbc.Toast(
-                                [html.H1(id='wprime_value')],
+                                [html.H1(id='wprime_value'), html.Small(id='wprime_interval')],
                                 header="W' (joules)",
                                 style={'max-width': '100%'}
                             )
@@ -123,6 +180,13 @@ analysis_layout = [
                         md=6)
                 ]
             ),
+            dbc.Row(
+                dbc.Col(
+                    id='sampler_output',
+                    md=12
+                ),
+                className='mt-2'
+            ),
             dbc.Row(
                 children=[
                     dbc.Col(
@@ -137,5 +201,12 @@ analysis_layout = [
     html.Div(
         id='hidden_data',
         style={'display': 'none'}
-    )
+    ),
+    # critical power and W' of the analysed activity, for the W' balance row
+    dcc.Store(id='analysis_params'),
+    # background job ids and the intervals polling them
+    dcc.Store(id='parse_job'),
+    dcc.Interval(id='parse_poll', interval=500, disabled=True),
+    dcc.Store(id='sampler_job'),
+    dcc.Interval(id='sampler_poll', interval=1000, disabled=True)
 ]
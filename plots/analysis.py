@@ -1,8 +1,15 @@
+from functools import lru_cache
+
 import numpy as np
-import pandas as pd
 from plotly.subplots import make_subplots
+import plotly.colors
 import plotly.graph_objects as go
-import plotly.express as px
+
+from plots.encoding import encode_values, time_axis
+from processing.downsample import downsample_indices
+from processing.histogram import fixed_width_histogram
+from processing.intervals import time_indices
+from processing.models import model_power
 
 analysis_plot_config = {
     'modeBarButtonsToRemove': ['lasso2d', 'autoScale2d', 'toggleSpikelines', 'hoverClosestCartesian',
@@ -10,15 +17,22 @@ analysis_plot_config = {
     'displaylogo': False,
     'displayModeBar': True}
 
-colors = px.colors.qualitative.Plotly
+colors = plotly.colors.qualitative.Plotly
 power_color = colors[0]
 speed_color = colors[1]
 elevation_color = '#D3D3D3'
 analysis_color = 'black'
 
 
-def analysis_data_plot(analysis_data):
-    n_rows = 3
+# Figures are built once per process as plain dicts ("skeletons") holding every trace style, axis and
+# template setting. Requests copy a skeleton shallowly and swap in their data arrays, skipping
+# make_subplots and plotly's per-property validation. Skeletons are shared and must never be mutated.
+# They are built on first use rather than at import, or by preload_figures in a server that imports the
+# app before forking its workers.
+
+
+def _analysis_data_skeleton():
+    n_rows = 4
     row_heights = [1 / n_rows] * n_rows
 
     figure = make_subplots(rows=n_rows, cols=1,
@@ -27,97 +41,78 @@ def analysis_data_plot(analysis_data):
                            row_heights=row_heights)
 
     figure.add_trace(
-        go.Scatter(x=analysis_data.time,
-                   y=analysis_data.elevation,
-                   fill='tozeroy',
+        go.Scatter(fill='tozeroy',
                    name='elevation',
                    mode="lines+markers",
                    line=dict(color=elevation_color),
                    marker=dict(size=1)), row=1, col=1)
 
     figure.add_trace(
-        go.Scatter(x=analysis_data.time,
-                   y=analysis_data.speed,
-                   name='speed',
+        go.Scatter(name='speed',
                    mode="lines+markers",
                    line=dict(color=speed_color),
                    marker=dict(size=1)), row=2, col=1)
 
     figure.add_trace(
-        go.Scatter(x=analysis_data.time,
-                   y=analysis_data.power,
-                   name='power',
+        go.Scatter(name='power',
                    mode="lines+markers",
                    line=dict(color=power_color),
                    marker=dict(size=1)), row=3, col=1)
 
+    figure.add_trace(
+        go.Scatter(name="W' balance",
+                   mode="lines",
+                   line=dict(color=analysis_color)), row=4, col=1)
+
     figure.update_yaxes(title_text="elevation (m)", row=1, col=1)
     figure.update_yaxes(title_text="speed (km/h)", row=2, col=1)
+    figure.update_xaxes(type="date")
     figure.update_xaxes(title_text="time", row=n_rows, col=1)
     figure.update_yaxes(title_text="power (watts)", row=3, col=1)
-    figure.update_layout(height=600, template="plotly_white", showlegend=False)
-
-    return figure
+    figure.update_yaxes(title_text="W' balance (J)", row=4, col=1)
+    figure.update_layout(height=800, template="plotly_white", showlegend=False, uirevision='analysis_data')
+    return figure.to_dict()
 
 
-def analysis_data_histogram_plot(speed, power):
-    figure = make_subplots(rows=1, cols=2, subplot_titles=("Average speed = {:2.1f} km/h".format(np.mean(speed)),
-                                                           "Average power = {:4.1f} watts".format(np.mean(power)))
-                           )
+def _analysis_data_histogram_skeleton():
+    figure = make_subplots(rows=1, cols=2, subplot_titles=("Average speed", "Average power"))
     figure.add_trace(
-        go.Histogram(x=speed, name='speed', marker_color=speed_color), row=1, col=1)
+        go.Bar(name='speed', marker_color=speed_color), row=1, col=1)
     figure.add_trace(
-        go.Histogram(x=power, name='power', marker_color=power_color), row=1, col=2)
+        go.Bar(name='power', marker_color=power_color), row=1, col=2)
 
     figure.update_xaxes(title_text="speed (km/h)", row=1, col=1)
     figure.update_xaxes(title_text="power (watts)", row=1, col=2)
     figure.update_layout(height=350, bargap=0.1, margin=dict(t=20), template="plotly_white", showlegend=False)
-    return figure
+    return figure.to_dict()
 
 
-def analysis_regression_plot(selected_data, cp, wprime):
-    selected_data_df = pd.DataFrame(selected_data)
+def _analysis_regression_skeleton():
     figure = make_subplots(rows=1, cols=2)
 
-    max_duration = 3600
-
-    work_done_duration = np.linspace(0, selected_data_df.duration_seconds.max()+100, 100)
-    work_done = work_done_duration * cp + wprime
-
-    power_duration = np.linspace(selected_data_df.duration_seconds.min(), max_duration, 1000)
-    power = wprime/power_duration + cp
-
     figure.add_trace(
-        go.Scatter(x=selected_data_df.duration_seconds,
-                   y=selected_data_df.total_energy/selected_data_df.duration_seconds,
-                   name='duration versus corrected power',
+        go.Scatter(name='duration versus corrected power',
                    mode="markers",
                    line=dict(color=analysis_color)
                    ),
         row=1, col=1
     )
     figure.add_trace(
-        go.Scatter(x=power_duration,
-                   y=power,
-                   mode="lines",
+        go.Scatter(mode="lines",
                    line=dict(color=analysis_color)
                    ),
         row=1, col=1
     )
 
     figure.add_trace(
-        go.Scatter(x=selected_data_df.duration_seconds,
-                   y=selected_data_df.total_energy,
-                   name='duration versus energy',
+        go.Scatter(name='duration versus energy',
                    mode="markers",
                    line=dict(color=analysis_color)
                    ),
         row=1, col=2
     )
     figure.add_trace(
-        go.Scatter(x=work_done_duration,
-                   y=work_done,
-                   mode="lines",
+        go.Scatter(mode="lines",
                    line=dict(color=analysis_color)
                    ),
         row=1, col=2
@@ -129,4 +124,104 @@ def analysis_regression_plot(selected_data, cp, wprime):
     figure.update_xaxes(title_text="duration (s)", row=1, col=2)
     figure.update_yaxes(title_text="work done (joules)", row=1, col=2)
     figure.update_layout(height=350, bargap=0.1, margin=dict(t=20), template="plotly_white", showlegend=False)
-    return figure
+    return figure.to_dict()
+
+
+@lru_cache(maxsize=1)
+def analysis_data_skeleton():
+    return _analysis_data_skeleton()
+
+
+@lru_cache(maxsize=1)
+def analysis_data_histogram_skeleton():
+    return _analysis_data_histogram_skeleton()
+
+
+@lru_cache(maxsize=1)
+def analysis_regression_skeleton():
+    return _analysis_regression_skeleton()
+
+
+def preload_figures():
+    analysis_data_skeleton()
+    analysis_data_histogram_skeleton()
+    analysis_regression_skeleton()
+
+
+def from_skeleton(skeleton, traces, **layout):
+    # a new figure dict sharing everything but the given trace values and top-level layout keys with skeleton
+    return {'data': [dict(trace, **values) for trace, values in zip(skeleton['data'], traces)],
+            'layout': dict(skeleton['layout'], **layout)}
+
+
+def _trace_samples(time, values, channel, start, stop):
+    values = np.asarray(values, dtype=np.float64)
+    index = downsample_indices(values, start, stop)
+    return dict(**time_axis(time[index]), y=encode_values(values[index], channel))
+
+
+def analysis_data_plot(analysis_data, window=None, wprime_balance=None):
+    skeleton = analysis_data_skeleton()
+
+    # plot the visible window, padded so short pans still show data, at up to MAX_POINTS per trace
+    start, stop = 0, len(analysis_data.time)
+    layout = {}
+    if window:
+        lower, upper = window
+        padding = (upper - lower) // 4
+        start, stop = time_indices(analysis_data.time, lower - padding, upper + padding)
+        x_range = [str(lower), str(upper)]
+        layout = {axis: dict(skeleton['layout'][axis], range=x_range)
+                  for axis in skeleton['layout'] if axis.startswith('xaxis')}
+
+    traces = [_trace_samples(analysis_data.time, getattr(analysis_data, channel), channel, start, stop)
+              for channel in ['elevation', 'speed', 'power']]
+    # W' balance needs critical power and W', so its row stays empty until they are known
+    if wprime_balance is None:
+        traces.append({'x': [], 'y': []})
+    else:
+        traces.append(_trace_samples(analysis_data.time, wprime_balance, 'wprime_balance', start, stop))
+    return from_skeleton(skeleton, traces, **layout)
+
+
+def analysis_data_histogram_plot(speed, power):
+    skeleton = analysis_data_histogram_skeleton()
+    titles = ["Average speed = {:2.1f} km/h".format(np.nanmean(speed)),
+              "Average power = {:4.1f} watts".format(np.nanmean(power))]
+    annotations = [dict(annotation, text=title)
+                   for annotation, title in zip(skeleton['layout']['annotations'], titles)]
+    # bin on the server so the payload does not grow with the length of the selection
+    traces = []
+    for values, channel in [(speed, 'speed'), (power, 'power')]:
+        histogram = fixed_width_histogram(values, channel)
+        traces.append({'x': histogram.center, 'y': histogram.count, 'width': histogram.width})
+    return from_skeleton(skeleton, traces, annotations=annotations)
+
+
+def analysis_regression_plot(selected_data, cp, wprime, selection=None):
+    import pandas as pd
+
+    selected_data_df = pd.DataFrame(selected_data)
+
+    max_duration = 3600
+
+    work_done_duration = np.linspace(0, selected_data_df.duration_seconds.max()+100, 100)
+    power_duration = np.linspace(selected_data_df.duration_seconds.min(), max_duration, 1000)
+
+    if selection is None or selection.model == 'linear':
+        work_done = work_done_duration * cp + wprime
+        power = wprime/power_duration + cp
+    else:
+        parameters = selection.fits[selection.model].parameters[0]
+        work_done_duration = work_done_duration[1:]
+        work_done = model_power(selection.model, parameters, work_done_duration) * work_done_duration
+        power = model_power(selection.model, parameters, power_duration)
+
+    traces = [
+        {'x': selected_data_df.duration_seconds.values,
+         'y': (selected_data_df.total_energy/selected_data_df.duration_seconds).values},
+        {'x': power_duration, 'y': power},
+        {'x': selected_data_df.duration_seconds.values, 'y': selected_data_df.total_energy.values},
+        {'x': work_done_duration, 'y': work_done},
+    ]
+    return from_skeleton(analysis_regression_skeleton(), traces)
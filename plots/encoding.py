@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+import plotly
+
+# decimals kept when sending each channel to the browser, matching the resolution the sensors record at
+SENSOR_DECIMALS = {
+    'distance': 2,  # 0.01 m
+    'speed': 2,  # 0.001 m/s is 0.0036 km/h
+    'power': 0,  # 1 watt
+    'elevation': 1,  # 0.2 m
+    'latitude': 6,
+    'longitude': 6,
+    'wprime_balance': 0,  # joules, derived from power
+}
+
+
+def encode_time(time):
+    # plotly date axes accept milliseconds since the unix epoch, which serialize far smaller than ISO strings
+    return np.asarray(time, dtype='datetime64[ms]').astype(np.int64)
+
+
+def time_axis(time):
+    # x arguments for a trace; uniformly sampled series are sent as a start and step instead of an array
+    x = encode_time(time)
+    if len(x) > 1:
+        step = np.diff(x)
+        if step[0] > 0 and (step == step[0]).all():
+            return {'x0': int(x[0]), 'dx': int(step[0])}
+    return {'x': x}
+
+
+def encode_values(values, channel):
+    return np.round(np.asarray(values, dtype=np.float64), SENSOR_DECIMALS[channel])
+
+
+def payload_size(obj):
+    return len(json.dumps(obj, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8'))
@@ -0,0 +1,28 @@
+from processing.cache import activity_cache
+from processing.intervals import build_interval_index
+from processing.resample import read_fit
+from processing.store import activity_store
+
+
+def load_activity(key):
+    # parsed activity from this worker's memory cache, falling back to the shared store. The store also holds
+    # the gaps and interval index the callbacks read, so an activity it has evicted is a miss even when the
+    # cache still has it, and is parsed again.
+    if not activity_store.touch(key):
+        return None
+    data = activity_cache.get(key)
+    if data is None:
+        data = activity_store.get(key)
+        if data is not None:
+            activity_cache.put(key, data)
+    return data
+
+
+def parse_activity(buffer, key, progress=None):
+    # decode a .fit file onto a uniform grid and add it, with its gaps and interval index, to the shared
+    # store; run as a background job
+    data, gaps = read_fit(buffer)
+    if progress:
+        progress(0.8)
+    activity_store.put(key, data, gaps, build_interval_index(data))
+    return key
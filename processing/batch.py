@@ -0,0 +1,122 @@
+import os
+import sys
+import hashlib
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from processing.cache import content_key
+from processing.resample import read_fit
+from processing.intervals import build_interval_index, interval_stats
+from processing.power_curve import FIT_DURATIONS, best_efforts, curve_durations, mean_maximal_power
+from processing.critical_power import DEFAULT_PRIOR, create_power_zones
+
+CURVE_DIR = os.environ.get('CPZONES_CURVE_DIR', os.path.join(tempfile.gettempdir(), 'cpzones-curves'))
+
+# every activity's curve is evaluated on the same durations so curves can be stacked, up to 24 hours
+SEASON_DURATIONS = curve_durations(24 * 3600, n=300)
+
+ActivityCurve = namedtuple('ActivityCurve', ['path', 'start', 'power'])
+SeasonCurve = namedtuple('SeasonCurve', ['duration', 'power', 'source'])
+
+
+def _durations_tag(durations):
+    return hashlib.blake2b(np.asarray(durations, dtype=np.int64).tobytes(), digest_size=4).hexdigest()
+
+
+def file_power_curve(path, durations=SEASON_DURATIONS, cache_dir=CURVE_DIR):
+    # mean-maximal power of one .fit file on the given durations (NaN beyond the activity length),
+    # cached on disk by file content so only new files are parsed
+    with open(path, 'rb') as f:
+        buffer = f.read()
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, '{}-{}.npz'.format(content_key(buffer), _durations_tag(durations)))
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                return ActivityCurve(path=path, start=cached['start'][()], power=cached['power'])
+
+    data, _ = read_fit(buffer)
+    curve = mean_maximal_power(build_interval_index(data), durations)
+    power = np.full(len(durations), np.nan)
+    power[:len(curve.power)] = curve.power
+    start = data.time[0] if len(data.time) else np.datetime64('NaT', 's')
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = '{}.{}.tmp.npz'.format(cache_path[:-4], os.getpid())
+        np.savez(temporary_path, start=start, power=power)
+        os.replace(temporary_path, cache_path)
+    return ActivityCurve(path=path, start=start, power=power)
+
+
+def map_files(function, paths, *args, processes=None, failed=None):
+    # yields function(path, *args) for each file as soon as its worker finishes;
+    # files that fail are reported, added to failed if given, and skipped
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(function, path, *args): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                print('{}: {}'.format(futures[future], e), file=sys.stderr)
+                if failed is not None:
+                    failed.append(futures[future])
+
+
+def power_curves(paths, durations=SEASON_DURATIONS, cache_dir=CURVE_DIR, processes=None, failed=None):
+    return map_files(file_power_curve, paths, durations, cache_dir, processes=processes, failed=failed)
+
+
+def read_activity(path):
+    with open(path, 'rb') as f:
+        data, _ = read_fit(f.read())
+    return data
+
+
+def file_power_zones(path, durations=FIT_DURATIONS, intervals=None, model='linear', prior=DEFAULT_PRIOR):
+    # CP, W' and zones of one .fit file, fitted to its best efforts or to the given (start, end) second offsets
+    data = read_activity(path)
+    index = build_interval_index(data)
+    if intervals:
+        spans = [(int(np.searchsorted(index.seconds, start, side='left')),
+                  int(np.searchsorted(index.seconds, end, side='right'))) for start, end in intervals]
+    else:
+        spans = best_efforts(index, durations)
+    rows = [interval_stats(data, index, start, stop) for start, stop in spans if stop - start > 1]
+    if len(rows) < 2:
+        raise ValueError('not enough intervals to fit critical power')
+    power_zones_df, cp, wprime, posterior, selection = create_power_zones(rows, prior=prior, model=model)
+    return {'file': path,
+            'start': str(data.time[0]),
+            'model': selection.model,
+            'cp': cp,
+            'wprime': wprime,
+            'posterior': posterior,
+            'zones': power_zones_df}
+
+
+def season_envelope(curves, durations=SEASON_DURATIONS, since=None):
+    # best power for each duration over all activities starting at or after since
+    powers = [curve.power for curve in curves if since is None or curve.start >= since]
+    if not powers:
+        return SeasonCurve(duration=np.zeros(0, dtype=np.int64), power=np.zeros(0), source=np.zeros(0, dtype=np.int64))
+    stacked = np.vstack(powers)
+    power = np.fmax.reduce(stacked, axis=0)
+    valid = ~np.isnan(power)
+    # index of the activity each best effort came from
+    source = np.argmax(np.where(np.isnan(stacked), -np.inf, stacked), axis=0)
+    return SeasonCurve(duration=np.asarray(durations)[valid], power=power[valid], source=source[valid])
+
+
+def envelope_intervals(envelope, durations=FIT_DURATIONS):
+    # envelope points in the form of selected_data_table rows, for create_power_zones
+    rows = []
+    for duration, power in zip(envelope.duration.tolist(), envelope.power.tolist()):
+        if duration in durations:
+            rows.append({'duration_seconds': float(duration),
+                         'average_power': power,
+                         'total_energy': power * duration})
+    return rows
@@ -0,0 +1,107 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from processing.fit import FitData
+
+CACHE_BYTES = int(os.environ.get('CPZONES_CACHE_BYTES', 256 * 2 ** 20))
+CACHE_DIR = os.environ.get('CPZONES_CACHE_DIR')
+
+
+# part of every key, changed when parsing changes so activities stored by older versions are not reused
+PARSE_VERSION = b'1hz-grid-gaps'
+
+
+def content_key(buffer):
+    return hashlib.blake2b(buffer, digest_size=16, person=PARSE_VERSION).hexdigest()
+
+
+def data_nbytes(data):
+    return sum(np.asarray(values).nbytes for values in data)
+
+
+class ActivityCache:
+    # LRU of parsed activities keyed by content hash, bounded by the size of the arrays it holds.
+    # Entries evicted from memory are written to spill_dir (if given) and reloaded from there on a later hit.
+
+    def __init__(self, max_bytes=CACHE_BYTES, spill_dir=CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.nbytes = 0
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._load(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.spill_hits += 1
+        self.put(key, data)
+        return data
+
+    def put(self, key, data):
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= data_nbytes(self._entries.pop(key))
+            self._entries[key] = data
+            self.nbytes += data_nbytes(data)
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_data = self._entries.popitem(last=False)
+                self.nbytes -= data_nbytes(old_data)
+                evicted.append((old_key, old_data))
+        for old_key, old_data in evicted:
+            self._spill(old_key, old_data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self.nbytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'spill_hits': self.spill_hits,
+                    'misses': self.misses}
+
+    def _spill_path(self, key):
+        if not self.spill_dir:
+            return None
+        return os.path.join(self.spill_dir, key + '.npz')
+
+    def _spill(self, key, data):
+        path = self._spill_path(key)
+        if path is None or os.path.exists(path):
+            return
+        temporary_path = '{}.{}.{}.tmp.npz'.format(path[:-4], os.getpid(), threading.get_ident())
+        np.savez(temporary_path, **data._asdict())
+        os.replace(temporary_path, path)
+
+    def _load(self, key):
+        path = self._spill_path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            return FitData(**{field: arrays[field] for field in FitData._fields})
+
+
+activity_cache = ActivityCache()
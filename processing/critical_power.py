@@ -0,0 +1,85 @@
+from collections import namedtuple
+
+import numpy as np
+
+from processing.models import ModelSelection, best_model, fit_models
+
+ZONES = ['Z1', 'Z2', 'Z3', 'Z4', 'Z5']
+ZONE_DESCRIPTIONS = ['Easy', 'Moderate', 'Threshold', 'Interval', 'Repetition']
+ZONE_LOWER = [0.65, 0.80, 0.9, 1, 1.15]
+ZONE_UPPER = [0.80, 0.9, 1, 1.15, 3]
+
+# Gaussian prior on (cp, wprime) and the relative error of each interval's measured energy
+Prior = namedtuple('Prior', ['cp_mean', 'cp_sd', 'wprime_mean', 'wprime_sd'])
+DEFAULT_PRIOR = Prior(cp_mean=250, cp_sd=100, wprime_mean=20000, wprime_sd=10000)
+ENERGY_ERROR = 0.05
+
+Posterior = namedtuple('Posterior', ['cp', 'wprime', 'cp_sd', 'wprime_sd', 'covariance'])
+
+# standard normal quantile of the 5% and 95% bounds
+Z_95 = 1.6448536269514722
+
+
+def critical_power_posterior(duration, energy, prior=DEFAULT_PRIOR, energy_error=ENERGY_ERROR):
+    # conjugate posterior of the linear work-time model with Gaussian errors of energy_error * energy,
+    # the closed form of the sampled fit in examples/test.py
+    duration = np.asarray(duration, dtype=np.float64)
+    energy = np.asarray(energy, dtype=np.float64)
+    design = np.column_stack([duration, np.ones_like(duration)])
+    # intervals without work have no relative error and are left out
+    valid = energy > 0
+    weight = np.where(valid, 1 / (energy_error * np.where(valid, energy, 1)) ** 2, 0)
+
+    prior_mean = np.array([prior.cp_mean, prior.wprime_mean])
+    prior_precision = np.diag([1 / prior.cp_sd ** 2, 1 / prior.wprime_sd ** 2])
+    precision = prior_precision + design.T @ (weight[:, None] * design)
+    covariance = np.linalg.inv(precision)
+    mean = covariance @ (prior_precision @ prior_mean + design.T @ (weight * energy))
+
+    return Posterior(cp=mean[0], wprime=mean[1], cp_sd=np.sqrt(covariance[0, 0]),
+                     wprime_sd=np.sqrt(covariance[1, 1]), covariance=covariance)
+
+
+def credible_interval(mean, sd):
+    return mean - Z_95 * sd, mean + Z_95 * sd
+
+
+def power_zones(cp, cp_sd=0):
+    # zone boundaries are fixed fractions of cp, so their 5% and 95% bounds are the same fractions of cp's
+    import pandas as pd
+
+    lower_factor, upper_factor = np.array(ZONE_LOWER), np.array(ZONE_UPPER)
+    cp_lower, cp_upper = credible_interval(cp, cp_sd)
+    return pd.DataFrame({
+        'zone': ZONES,
+        'lower power': cp * lower_factor,
+        'upper power': cp * upper_factor,
+        'lower power 5%': cp_lower * lower_factor,
+        'lower power 95%': cp_upper * lower_factor,
+        'upper power 5%': cp_lower * upper_factor,
+        'upper power 95%': cp_upper * upper_factor,
+        'description': ZONE_DESCRIPTIONS
+    })
+
+
+def create_power_zones(selected_data, data=None, prior=DEFAULT_PRIOR, model='linear'):
+    # zones from the given model, or from the one with the lowest AICc when model is 'best'. Only the linear
+    # model uses the prior, the others are fitted to the intervals alone.
+    import pandas as pd
+
+    select_data_df = pd.DataFrame(selected_data)
+    duration = select_data_df.duration_seconds.values
+    # fit_models leaves out intervals without a duration
+    with np.errstate(divide='ignore', invalid='ignore'):
+        power = select_data_df.total_energy.values / duration
+    fits = fit_models(duration, power)
+    if model == 'best':
+        model = best_model(fits)[0]
+    if model == 'linear':
+        posterior = critical_power_posterior(select_data_df.duration_seconds, select_data_df.total_energy, prior)
+    else:
+        fit = fits[model]
+        posterior = Posterior(cp=fit.cp[0], wprime=fit.wprime[0], cp_sd=fit.cp_sd[0], wprime_sd=fit.wprime_sd[0],
+                              covariance=fit.covariance[0])
+    power_zones_df = power_zones(posterior.cp, posterior.cp_sd)
+    return power_zones_df, posterior.cp, posterior.wprime, posterior, ModelSelection(model, fits)
@@ -0,0 +1,24 @@
+import numpy as np
+
+MAX_POINTS = 2000  # per trace
+
+
+def downsample_indices(values, start=0, stop=None, max_points=MAX_POINTS):
+    # indices of samples [start, stop) to plot: every sample if there are few enough, otherwise the
+    # minimum and maximum of each of max_points / 2 equal buckets, so peaks survive at any zoom level
+    stop = len(values) if stop is None else stop
+    n = stop - start
+    if n <= max_points:
+        return np.arange(start, stop)
+
+    n_buckets = max_points // 2
+    bucket_size = -(-n // n_buckets)
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = values[start:stop]
+    buckets = padded.reshape(n_buckets, bucket_size)
+    missing = np.isnan(buckets)
+    offsets = np.arange(n_buckets) * bucket_size
+    lowest = np.argmin(np.where(missing, np.inf, buckets), axis=1) + offsets
+    highest = np.argmax(np.where(missing, -np.inf, buckets), axis=1) + offsets
+    indices = np.unique(np.concatenate([[0, n - 1], lowest, highest]))
+    return indices[indices < n] + start
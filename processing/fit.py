@@ -0,0 +1,285 @@
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+FitData = namedtuple('FitData', ['time', 'distance', 'speed', 'power', 'elevation', 'latitude', 'longitude'])
+
+# dtype each field is kept in, with NaN for missing values. float32 holds every channel to well below its
+# sensor resolution; positions stay float64 as float32 would round them to about half a metre.
+FIELD_DTYPES = {
+    'time': 'datetime64[s]',
+    'distance': np.float32,
+    'speed': np.float32,
+    'power': np.float32,
+    'elevation': np.float32,
+    'latitude': np.float64,
+    'longitude': np.float64,
+}
+
+FIT_EPOCH = 631065600  # 1989-12-31T00:00:00Z in unix seconds
+SEMICIRCLES_TO_DEGREES = 180 / 2 ** 31
+
+RECORD_MESSAGE = 20
+TIMESTAMP_FIELD = 253
+
+# base type number -> (numpy type, invalid value)
+BASE_TYPES = {
+    0x00: ('u1', 0xFF),
+    0x01: ('i1', 0x7F),
+    0x02: ('u1', 0xFF),
+    0x03: ('i2', 0x7FFF),
+    0x04: ('u2', 0xFFFF),
+    0x05: ('i4', 0x7FFFFFFF),
+    0x06: ('u4', 0xFFFFFFFF),
+    0x08: ('f4', None),
+    0x09: ('f8', None),
+    0x0A: ('u1', 0x00),
+    0x0B: ('u2', 0x0000),
+    0x0C: ('u4', 0x00000000),
+    0x0E: ('i8', 0x7FFFFFFFFFFFFFFF),
+    0x0F: ('u8', 0xFFFFFFFFFFFFFFFF),
+    0x10: ('u8', 0x0000000000000000),
+}
+
+# record fields to decode: name -> candidate (field number, scale, offset) in order of preference
+RECORD_FIELDS = {
+    'timestamp': [(TIMESTAMP_FIELD, 1, 0)],
+    'distance': [(5, 100, 0)],
+    'speed': [(73, 1000, 0), (6, 1000, 0)],  # enhanced_speed, speed (m/s)
+    'power': [(7, 1, 0)],
+    'elevation': [(78, 5, 500), (2, 5, 500)],  # enhanced_altitude, altitude (m)
+    'latitude': [(0, 1, 0)],  # semicircles
+    'longitude': [(1, 1, 0)],  # semicircles
+}
+
+# bytes checked per step of crc16, a power of two
+CRC_CHUNK = 2 ** 20
+
+
+def _crc_table():
+    # CRC-16 with the reflected 0x8005 polynomial used by FIT files
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return np.array(table, dtype=np.uint16)
+
+
+def _shift(tables, crc):
+    low, high = tables
+    return low[crc & 0xFF] ^ high[crc >> 8]
+
+
+def _crc_shift_tables(table):
+    # tables of the register after 2 ** k zero bytes, for its low and high byte. The CRC is linear, so these
+    # give the CRC of two blocks from the CRCs of each, the first shifted by the length of the second.
+    tables = [(table, np.arange(256, dtype=np.uint16))]
+    while len(tables) <= CRC_CHUNK.bit_length():
+        tables.append(tuple(_shift(tables[-1], values) for values in tables[-1]))
+    return tables
+
+
+CRC_TABLE = _crc_table()
+CRC_SHIFT_TABLES = _crc_shift_tables(CRC_TABLE)
+# CRC from zero of each little-endian pair of bytes
+CRC_WORD_TABLE = _shift(CRC_SHIFT_TABLES[1], np.arange(2 ** 16, dtype=np.uint16))
+
+_Definition = namedtuple('_Definition', ['global_number', 'endian', 'fields', 'size'])
+
+
+def _shift_bytes(crc, n):
+    # the register after n zero bytes
+    level = 0
+    while n:
+        if n & 1:
+            crc = int(_shift(CRC_SHIFT_TABLES[level], crc))
+        n >>= 1
+        level += 1
+    return crc
+
+
+def crc16(buffer, crc=0):
+    # the CRCs of pairs of bytes are combined in pairs, then pairs of those, and so on, each level in one numpy
+    # step; a short first block is as if padded with leading zero bytes, which do not change a CRC from zero
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    for start in range(0, len(data), CRC_CHUNK):
+        chunk = data[start:start + CRC_CHUNK]
+        words = np.concatenate([np.zeros(len(chunk) % 2, dtype=np.uint8), chunk]).view('<u2')
+        values = CRC_WORD_TABLE[words]
+        level = 1
+        while len(values) > 1:
+            if len(values) % 2:
+                values = np.concatenate([np.zeros(1, dtype=np.uint16), values])
+            values = _shift(CRC_SHIFT_TABLES[level], values[0::2]) ^ values[1::2]
+            level += 1
+        crc = _shift_bytes(crc, len(chunk)) ^ int(values[0])
+    return crc
+
+
+def check_header(buffer):
+    if len(buffer) < 12:
+        raise ValueError('file is too short to be a FIT file')
+    header_size = buffer[0]
+    if header_size not in (12, 14) or bytes(buffer[8:12]) != b'.FIT':
+        raise ValueError('missing FIT file header')
+    if len(buffer) < header_size:
+        raise ValueError('truncated FIT file header')
+    if header_size == 14:
+        header_crc = struct.unpack_from('<H', buffer, 12)[0]
+        if header_crc and crc16(buffer[:12]) != header_crc:
+            raise ValueError('FIT file header CRC mismatch')
+    data_size = struct.unpack_from('<I', buffer, 4)[0]
+    return header_size, data_size
+
+
+def check_crc(buffer):
+    header_size, data_size = check_header(buffer)
+    file_size = header_size + data_size + 2
+    if len(buffer) < file_size:
+        raise ValueError('truncated FIT file')
+    # the CRC of the data followed by its stored CRC is zero
+    if crc16(buffer[:file_size]) != 0:
+        raise ValueError('FIT file CRC mismatch')
+
+
+def _read_definition(buffer, pos, has_developer_fields):
+    architecture = buffer[pos + 2]
+    endian = '>' if architecture else '<'
+    global_number, n_fields = struct.unpack_from(endian + 'HB', buffer, pos + 3)
+    fields = {}
+    size = 0
+    field_pos = pos + 6
+    for _ in range(n_fields):
+        number, field_size, base_type = buffer[field_pos], buffer[field_pos + 1], buffer[field_pos + 2]
+        fields[number] = (size, field_size, base_type & 0x1F)
+        size += field_size
+        field_pos += 3
+    if has_developer_fields:
+        n_developer_fields = buffer[field_pos]
+        field_pos += 1
+        for _ in range(n_developer_fields):
+            size += buffer[field_pos + 1]
+            field_pos += 3
+    return _Definition(global_number, endian, fields, size), field_pos
+
+
+def _index_records(buffer, start, end):
+    # single pass over the message headers, remembering where each record message starts
+    definitions = []
+    local_definitions = {}
+    positions = []
+    definition_ids = []
+    time_offsets = []
+    pos = start
+    while pos < end:
+        header = buffer[pos]
+        if header & 0x80:
+            # compressed timestamp header
+            local_type = (header >> 5) & 0x03
+            time_offset = header & 0x1F
+        elif header & 0x40:
+            definition, pos = _read_definition(buffer, pos, header & 0x20)
+            local_definitions[header & 0x0F] = len(definitions)
+            definitions.append(definition)
+            continue
+        else:
+            local_type = header & 0x0F
+            time_offset = -1
+        pos += 1
+        try:
+            definition_id = local_definitions[local_type]
+        except KeyError:
+            raise ValueError('data message without definition at byte {}'.format(pos - 1))
+        if definitions[definition_id].global_number == RECORD_MESSAGE:
+            positions.append(pos)
+            definition_ids.append(definition_id)
+            time_offsets.append(time_offset)
+        pos += definitions[definition_id].size
+    if pos > end:
+        raise ValueError('truncated data message')
+    return (definitions,
+            np.array(positions, dtype=np.int64),
+            np.array(definition_ids, dtype=np.int64),
+            np.array(time_offsets, dtype=np.int64))
+
+
+def _decode_field(raw, definition, candidates):
+    for number, scale, offset in candidates:
+        if number not in definition.fields:
+            continue
+        field_offset, field_size, base_type = definition.fields[number]
+        if base_type not in BASE_TYPES:
+            continue
+        type_code, invalid = BASE_TYPES[base_type]
+        dtype = np.dtype(definition.endian + type_code)
+        if field_size != dtype.itemsize:
+            continue
+        values = raw[:, field_offset:field_offset + field_size].copy().view(dtype).reshape(-1)
+        decoded = values.astype(np.float64)
+        if invalid is not None:
+            decoded[values == invalid] = np.nan
+        if scale != 1 or offset != 0:
+            decoded = decoded / scale - offset
+        return decoded
+    return None
+
+
+def _expand_compressed_timestamps(timestamp, time_offsets):
+    if not (time_offsets >= 0).any():
+        return
+    last = None
+    for i, time_offset in enumerate(time_offsets.tolist()):
+        if time_offset >= 0 and last is not None:
+            timestamp[i] = last + ((time_offset - last) & 0x1F)
+        if not np.isnan(timestamp[i]):
+            last = int(timestamp[i])
+
+
+def decode_records(buffer):
+    buffer = memoryview(buffer).cast('B')
+    header_size, data_size = check_header(buffer)
+    start = header_size
+    end = min(header_size + data_size, len(buffer))
+
+    definitions, positions, definition_ids, time_offsets = _index_records(buffer, start, end)
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    n = len(positions)
+    columns = {name: np.full(n, np.nan) for name in RECORD_FIELDS}
+    for definition_id in np.unique(definition_ids):
+        definition = definitions[definition_id]
+        mask = definition_ids == definition_id
+        # gather every message sharing this definition into one (n_messages, size) byte matrix
+        raw = data[positions[mask, None] + np.arange(definition.size)]
+        for name, candidates in RECORD_FIELDS.items():
+            values = _decode_field(raw, definition, candidates)
+            if values is not None:
+                columns[name][mask] = values
+
+    _expand_compressed_timestamps(columns['timestamp'], time_offsets)
+    return columns
+
+
+def compact(data):
+    return FitData(**{field: np.asarray(getattr(data, field), dtype=FIELD_DTYPES[field]) for field in FitData._fields})
+
+
+def decode_fit(buffer):
+    check_crc(buffer)
+    columns = decode_records(buffer)
+
+    timestamp = columns['timestamp']
+    missing_time = np.isnan(timestamp)
+    time = (np.where(missing_time, 0, timestamp).astype(np.int64) + FIT_EPOCH).astype('datetime64[s]')
+    time[missing_time] = np.datetime64('NaT')
+
+    return compact(FitData(time=time,
+                           distance=columns['distance'],
+                           speed=columns['speed'] * 3.6,
+                           power=columns['power'],
+                           elevation=columns['elevation'],
+                           latitude=columns['latitude'] * SEMICIRCLES_TO_DEGREES,
+                           longitude=columns['longitude'] * SEMICIRCLES_TO_DEGREES))
@@ -0,0 +1,32 @@
+from collections import namedtuple
+
+import numpy as np
+
+# smallest step each channel is recorded in: 0.001 m/s of speed in km/h, 1 watt of power
+SENSOR_RESOLUTION = {'speed': 0.0036, 'power': 1}
+MAX_BINS = 60
+
+Histogram = namedtuple('Histogram', ['center', 'count', 'width'])
+
+
+def bin_width(span, resolution, max_bins=MAX_BINS):
+    # the smallest 1, 2, 5 x 10^n width that is no finer than the sensor and gives at most max_bins bins
+    target = max(resolution, span / max_bins)
+    magnitude = 10 ** np.floor(np.log10(target))
+    for step in [1, 2, 5, 10]:
+        if step * magnitude >= target:
+            return float(step * magnitude)
+
+
+def fixed_width_histogram(values, channel, max_bins=MAX_BINS):
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return Histogram(center=np.zeros(0), count=np.zeros(0, dtype=np.int64), width=0.0)
+    lowest, highest = values.min(), values.max()
+    width = bin_width(highest - lowest, SENSOR_RESOLUTION[channel], max_bins)
+    first = np.floor(lowest / width) * width
+    bins = np.floor((values - first) / width).astype(np.int64)
+    count = np.bincount(bins)
+    center = first + (np.arange(len(count)) + 0.5) * width
+    return Histogram(center=center, count=count, width=width)
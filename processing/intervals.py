@@ -0,0 +1,97 @@
+from collections import namedtuple
+
+import numpy as np
+
+from processing.resample import RESAMPLE_INTERVAL
+
+# cumulative sums over an activity, built once at upload so statistics of any interval are O(1).
+# seconds and energy are per sample (energy[k] is the work done up to sample k), the *_sum and
+# *_count arrays have a leading zero so samples [start, stop) sum to x[stop] - x[start].
+IntervalIndex = namedtuple('IntervalIndex', ['seconds', 'energy', 'power_sum', 'power_count',
+                                             'speed_sum', 'speed_count'])
+
+
+def _cumulative(values):
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    total = np.concatenate([[0], np.cumsum(np.where(valid, values, 0))])
+    count = np.concatenate([[0], np.cumsum(valid)])
+    return total, count
+
+
+def sample_durations(seconds):
+    # seconds each sample does work for, the time since the previous sample up to the resampling interval,
+    # so the first sample after a recording gap is not credited with the whole pause
+    durations = np.zeros(len(seconds))
+    durations[1:] = np.minimum(np.diff(seconds), RESAMPLE_INTERVAL)
+    return durations
+
+
+def build_interval_index(data):
+    time = np.asarray(data.time)
+    seconds = ((time - time[0]) / np.timedelta64(1, 's')) if len(time) else np.zeros(0)
+    power = np.asarray(data.power, dtype=np.float64)
+
+    # energy of each sample is its power over the time since the previous sample, none across a gap
+    energy = np.cumsum(np.nan_to_num(sample_durations(seconds) * power))
+
+    power_sum, power_count = _cumulative(power)
+    speed_sum, speed_count = _cumulative(data.speed)
+    return IntervalIndex(seconds=seconds, energy=energy, power_sum=power_sum, power_count=power_count,
+                         speed_sum=speed_sum, speed_count=speed_count)
+
+
+def _parse_time(value):
+    return np.datetime64(str(value).replace(' ', 'T'), 'ms')
+
+
+def time_indices(time, lower, upper):
+    # [start, stop) samples with lower <= time <= upper
+    time_ms = np.asarray(time).astype('datetime64[ms]')
+    return int(np.searchsorted(time_ms, lower, side='left')), int(np.searchsorted(time_ms, upper, side='right'))
+
+
+def selection_indices(selected_data, time):
+    # resolve a plotly selectedData payload to the [start, stop) samples it spans. The plotted traces
+    # are downsampled, so selections are mapped back through time rather than point indices.
+    ranges = (selected_data or {}).get('range') or {}
+    x_range = next((values for axis, values in ranges.items() if axis.startswith('x')), None)
+    if not x_range:
+        x_range = [point['x'] for point in (selected_data or {}).get('points') or [] if 'x' in point]
+    if not x_range:
+        return 0, 0
+    times = [_parse_time(value) for value in x_range]
+    return time_indices(time, min(times), max(times))
+
+
+def relayout_range(relayout_data):
+    # x range of a zoom or pan event on any of the shared x axes, None for other relayout events
+    relayout_data = relayout_data or {}
+    for key, value in relayout_data.items():
+        if key.startswith('xaxis') and key.endswith('.range[0]'):
+            upper = relayout_data.get(key[:-3] + '[1]')
+            if upper is not None:
+                return _parse_time(value), _parse_time(upper)
+        if key.startswith('xaxis') and key.endswith('.range') and len(value) == 2:
+            return _parse_time(value[0]), _parse_time(value[1])
+    return None
+
+
+def is_autorange(relayout_data):
+    return any(key.startswith('xaxis') and key.endswith('.autorange') and value
+               for key, value in (relayout_data or {}).items())
+
+
+def _mean(total, count, start, stop):
+    n = count[stop] - count[start]
+    return float((total[stop] - total[start]) / n) if n else float('nan')
+
+
+def interval_stats(data, index, start, stop):
+    last = stop - 1
+    return {'interval_start': str(data.time[start]),
+            'interval_end': str(data.time[last]),
+            'duration_seconds': float(index.seconds[last] - index.seconds[start]),
+            'average_speed': _mean(index.speed_sum, index.speed_count, start, stop),
+            'average_power': _mean(index.power_sum, index.power_count, start, stop),
+            'total_energy': float(index.energy[last] - index.energy[start])}
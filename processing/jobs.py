@@ -0,0 +1,161 @@
+import os
+import time
+import uuid
+import pickle
+import sqlite3
+import tempfile
+import threading
+import functools
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+JOBS_DB = os.environ.get('CPZONES_JOBS_DB', os.path.join(tempfile.gettempdir(), 'cpzones-jobs.sqlite'))
+JOB_WORKERS = int(os.environ.get('CPZONES_JOB_WORKERS', os.cpu_count() or 1))
+PARSE_WORKERS = int(os.environ.get('CPZONES_PARSE_WORKERS', 1))
+JOB_TTL = 3600  # seconds finished jobs are kept for
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED = 'pending', 'running', 'done', 'failed', 'cancelled'
+
+Job = namedtuple('Job', ['id', 'status', 'progress', 'error'])
+
+
+class Cancelled(Exception):
+    pass
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+def _create(path):
+    with _connect(path) as connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, progress REAL, '
+                           'result BLOB, error TEXT, cancelled INTEGER DEFAULT 0, updated REAL)')
+
+
+def _update(path, job_id, **values):
+    values['updated'] = time.time()
+    columns = ', '.join('{} = ?'.format(column) for column in values)
+    with _connect(path) as connection:
+        connection.execute('UPDATE jobs SET {} WHERE id = ?'.format(columns), list(values.values()) + [job_id])
+
+
+def _is_cancelled(path, job_id):
+    with _connect(path) as connection:
+        row = connection.execute('SELECT cancelled FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return row is None or bool(row[0])
+
+
+class Progress:
+    # passed to job functions as their progress keyword; reports the fraction done and raises Cancelled
+    # once the job has been cancelled, so long running work stops at its next report
+
+    def __init__(self, path, job_id):
+        self.path = path
+        self.job_id = job_id
+
+    def __call__(self, fraction):
+        if _is_cancelled(self.path, self.job_id):
+            raise Cancelled()
+        _update(self.path, self.job_id, progress=min(max(fraction, 0), 1))
+
+
+def _execute(path, job_id, function, args):
+    if _is_cancelled(path, job_id):
+        _update(path, job_id, status=CANCELLED)
+        return
+    _update(path, job_id, status=RUNNING)
+    try:
+        result = function(*args, progress=Progress(path, job_id))
+    except Cancelled:
+        _update(path, job_id, status=CANCELLED)
+    except Exception as e:
+        _update(path, job_id, status=FAILED, error=str(e))
+    else:
+        _update(path, job_id, status=DONE, progress=1, result=pickle.dumps(result))
+
+
+class JobRunner:
+    # Runs functions in a local process pool, keeping their state and results in a SQLite file so any
+    # worker on the host can poll a job by id. Job functions take a progress keyword argument.
+
+    def __init__(self, path=JOBS_DB, workers=JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        _create(path)
+
+    def submit(self, function, *args):
+        self._expire()
+        job_id = uuid.uuid4().hex
+        with _connect(self.path) as connection:
+            connection.execute('INSERT INTO jobs (id, status, progress, updated) VALUES (?, ?, 0, ?)',
+                               (job_id, PENDING, time.time()))
+        pool = self._pool()
+        try:
+            future = pool.submit(_execute, self.path, job_id, function, args)
+        except BrokenProcessPool:
+            # a process of the pool died since the last job, start a new pool
+            self._discard(pool)
+            pool = self._pool()
+            future = pool.submit(_execute, self.path, job_id, function, args)
+        future.add_done_callback(functools.partial(self._finished, pool, job_id))
+        return job_id
+
+    def status(self, job_id):
+        with _connect(self.path) as connection:
+            row = connection.execute('SELECT id, status, progress, error FROM jobs WHERE id = ?',
+                                     (job_id,)).fetchone()
+        return Job(*row) if row else None
+
+    def result(self, job_id):
+        with _connect(self.path) as connection:
+            row = connection.execute('SELECT result FROM jobs WHERE id = ? AND status = ?',
+                                     (job_id, DONE)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def cancel(self, job_id):
+        with _connect(self.path) as connection:
+            connection.execute('UPDATE jobs SET cancelled = 1 WHERE id = ?', (job_id,))
+
+    def _pool(self):
+        # created on first use and with spawned processes, so importing the app never forks a threaded server
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._executor is pool:
+                self._executor = None
+        pool.shutdown(wait=False)
+
+    def _finished(self, pool, job_id, future):
+        # _execute records how every job ends, so an exception here means the job never ran or its process
+        # died, which also breaks the pool for the jobs after it
+        if future.cancelled():
+            _update(self.path, job_id, status=CANCELLED)
+            return
+        error = future.exception()
+        if error is None:
+            return
+        _update(self.path, job_id, status=FAILED, error=str(error) or type(error).__name__)
+        if isinstance(error, BrokenProcessPool):
+            self._discard(pool)
+
+    def _expire(self):
+        with _connect(self.path) as connection:
+            connection.execute('DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated < ?',
+                               (DONE, FAILED, CANCELLED, time.time() - JOB_TTL))
+
+
+# parsing has its own pool, so an upload never waits behind queued sampler runs
+job_runner = JobRunner()
+parse_runner = JobRunner(workers=PARSE_WORKERS)
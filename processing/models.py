@@ -0,0 +1,231 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Power-duration models fitted to interval (duration, average power) pairs, batched over rows so many
+# activities or athletes are fitted in one pass. Durations and powers are (n_batch, n_intervals) arrays,
+# padded with NaN where a row has fewer intervals.
+#
+#   linear           energy = cp * duration + wprime, least squares on energy with relative errors
+#   hyperbolic       power = cp + wprime / duration, least squares on power
+#   three_parameter  power = cp + wprime / (duration + wprime / (pmax - cp))
+#   exponential      power = cp + (pmax - cp) * exp(-duration / tau)
+MODELS = ['linear', 'hyperbolic', 'three_parameter', 'exponential']
+# models best_model chooses between. linear and hyperbolic are the same curve, and hyperbolic minimises the
+# power residuals every criterion is computed from, so ranking both would always discard linear and its prior
+RANKED_MODELS = ['linear', 'three_parameter', 'exponential']
+
+# every field has the batch as its first axis; covariance is of (cp, wprime)
+ModelFit = namedtuple('ModelFit', ['parameters', 'cp', 'wprime', 'pmax', 'cp_sd', 'wprime_sd', 'covariance',
+                                   'rss', 'aic', 'aicc', 'bic', 'converged'])
+ModelSelection = namedtuple('ModelSelection', ['model', 'fits'])
+
+
+def _hyperbolic(theta, duration):
+    # theta is (cp, wprime)
+    jacobian = np.stack([np.ones_like(duration), 1 / duration], axis=-1)
+    return theta[:, 0:1] + theta[:, 1:2] / duration, jacobian
+
+
+def _three_parameter(theta, duration):
+    # theta is (cp, wprime, k) with k = wprime / (pmax - cp)
+    cp, wprime, k = theta[:, 0:1], theta[:, 1:2], theta[:, 2:3]
+    shifted = np.where((cp > 0) & (k > 0) & (wprime > 0), duration + k, np.nan)
+    jacobian = np.stack([np.ones_like(duration), 1 / shifted, -wprime / shifted ** 2], axis=-1)
+    return cp + wprime / shifted, jacobian
+
+
+def _exponential(theta, duration):
+    # theta is (cp, amplitude, tau) with amplitude = pmax - cp
+    cp, amplitude, tau = theta[:, 0:1], theta[:, 1:2], theta[:, 2:3]
+    decay = np.exp(-duration / np.where((cp > 0) & (tau > 0) & (amplitude > 0), tau, np.nan))
+    jacobian = np.stack([np.ones_like(duration), decay, amplitude * decay * duration / tau ** 2], axis=-1)
+    return cp + amplitude * decay, jacobian
+
+
+MODEL_FUNCTIONS = {
+    'linear': _hyperbolic,
+    'hyperbolic': _hyperbolic,
+    'three_parameter': _three_parameter,
+    'exponential': _exponential,
+}
+
+
+def model_power(model, parameters, duration):
+    # power of one fitted model at the given durations
+    duration = np.asarray(duration, dtype=np.float64)
+    power, _ = MODEL_FUNCTIONS[model](np.asarray(parameters, dtype=np.float64)[None, :], duration[None, :])
+    return power[0]
+
+
+def _as_batch(duration, power):
+    duration = np.atleast_2d(np.asarray(duration, dtype=np.float64))
+    power = np.atleast_2d(np.asarray(power, dtype=np.float64))
+    mask = np.isfinite(duration) & np.isfinite(power) & (duration > 0)
+    # masked points get a harmless duration and a zero weight
+    return np.where(mask, duration, 1.0), np.where(mask, power, 0.0), mask
+
+
+def _linear_least_squares(design, target, weight):
+    # batched weighted least squares of target on the columns of design, with the parameter covariance
+    weighted = design * weight[..., None]
+    normal = np.einsum('bni,bnj->bij', weighted, design)
+    covariance = np.linalg.pinv(normal)
+    theta = np.einsum('bij,bj->bi', covariance, np.einsum('bni,bn->bi', weighted, target))
+    return theta, covariance
+
+
+def _levenberg_marquardt(function, theta, duration, power, mask, max_iterations=200, tolerance=1e-8):
+    # batched damped Gauss-Newton on the power residuals, each row with its own damping; only rows
+    # still converging are evaluated
+    def evaluate(theta, rows):
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            model, jacobian = function(theta, duration[rows])
+        residual = np.where(mask[rows], model - power[rows], 0.0)
+        return residual, np.where(mask[rows, :, None], jacobian, 0.0), np.sum(residual ** 2, axis=1)
+
+    theta = theta.copy()
+    rows = np.arange(len(theta))
+    residual, jacobian, cost = evaluate(theta, rows)
+    final_jacobian = jacobian.copy()
+    damping = np.full(len(theta), 1e-3)
+    converged = np.zeros(len(theta), dtype=bool)
+    identity = np.eye(theta.shape[1])
+    for _ in range(max_iterations):
+        normal = np.einsum('bni,bnj->bij', jacobian, jacobian)
+        gradient = np.einsum('bni,bn->bi', jacobian, residual)
+        scale = np.einsum('bii->bi', normal)[:, None, :] * identity + 1e-12 * identity
+        with np.errstate(invalid='ignore'):
+            step = np.linalg.solve(normal + damping[rows, None, None] * scale, -gradient[..., None])[..., 0]
+        new_residual, new_jacobian, new_cost = evaluate(theta[rows] + step, rows)
+
+        better = new_cost <= cost
+        theta[rows[better]] += step[better]
+        residual[better] = new_residual[better]
+        jacobian[better] = new_jacobian[better]
+        cost[better] = new_cost[better]
+        small_step = np.all(np.abs(step) <= tolerance * (np.abs(theta[rows]) + tolerance), axis=1)
+        damping[rows] = np.where(better, damping[rows] / 10, damping[rows] * 10)
+        done = (better & small_step) | (damping[rows] > 1e12)
+
+        converged[rows[done]] = True
+        final_jacobian[rows[done]] = jacobian[done]
+        keep = ~done
+        rows, residual, jacobian, cost = rows[keep], residual[keep], jacobian[keep], cost[keep]
+        if not len(rows):
+            break
+    final_jacobian[rows] = jacobian
+    return theta, final_jacobian, converged
+
+
+def _statistics(residual, mask, n_parameters):
+    n = mask.sum(axis=1)
+    rss = np.sum(np.where(mask, residual, 0.0) ** 2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_likelihood = n * np.log(np.maximum(rss, np.finfo(np.float64).tiny) / n)
+        aic = log_likelihood + 2 * n_parameters
+        aicc = np.where(n - n_parameters - 1 > 0,
+                        aic + 2 * n_parameters * (n_parameters + 1) / (n - n_parameters - 1), np.inf)
+        bic = log_likelihood + n_parameters * np.log(n)
+    return rss, aic, aicc, bic
+
+
+def _parameter_covariance(jacobian, rss, mask):
+    # Gauss-Newton covariance, residual variance times the inverse of J'J
+    n_parameters = jacobian.shape[-1]
+    degrees_of_freedom = mask.sum(axis=1) - n_parameters
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(degrees_of_freedom > 0, rss / degrees_of_freedom, np.nan)
+    return variance[:, None, None] * np.linalg.pinv(np.einsum('bni,bnj->bij', jacobian, jacobian))
+
+
+def _model_fit(parameters, cp, wprime, pmax, covariance, residual, mask, n_parameters, converged):
+    rss, aic, aicc, bic = _statistics(residual, mask, n_parameters)
+    return ModelFit(parameters=parameters, cp=cp, wprime=wprime, pmax=pmax,
+                    cp_sd=np.sqrt(covariance[:, 0, 0]), wprime_sd=np.sqrt(covariance[:, 1, 1]),
+                    covariance=covariance, rss=rss, aic=aic, aicc=aicc, bic=bic, converged=converged)
+
+
+def _transform_covariance(covariance, gradient):
+    # covariance of (cp, wprime) from that of the parameters, gradient is (n_batch, 2, n_parameters)
+    return np.einsum('bij,bjk,blk->bil', gradient, covariance, gradient)
+
+
+def fit_models(duration, power, energy_error=0.05):
+    duration, power, mask = _as_batch(duration, power)
+    fits = {}
+
+    # linear work-time model, weighted like critical_power_posterior but without its prior
+    energy = power * duration
+    design = np.stack([duration, np.ones_like(duration)], axis=-1)
+    with np.errstate(divide='ignore'):
+        weight = np.where(mask, 1 / np.maximum(energy_error * energy, 1e-9) ** 2, 0.0)
+    theta, covariance = _linear_least_squares(design, energy, weight)
+    residual = theta[:, 0:1] + theta[:, 1:2] / duration - power
+    energy_residual = np.where(mask, (design @ theta[..., None])[..., 0] - energy, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi_square = np.sum(weight * energy_residual ** 2, axis=1) / (mask.sum(axis=1) - 2)
+    covariance = np.where(mask.sum(axis=1)[:, None, None] > 2, chi_square[:, None, None] * covariance, np.nan)
+    fits['linear'] = _model_fit(theta, theta[:, 0], theta[:, 1], np.full(len(theta), np.inf), covariance,
+                                residual, mask, 2, np.ones(len(theta), dtype=bool))
+
+    # hyperbolic power-duration model, linear in its parameters
+    design = np.stack([np.ones_like(duration), 1 / duration], axis=-1)
+    theta, _ = _linear_least_squares(design, power, mask.astype(np.float64))
+    residual = np.where(mask, (design @ theta[..., None])[..., 0] - power, 0.0)
+    rss = np.sum(residual ** 2, axis=1)
+    covariance = _parameter_covariance(np.where(mask[..., None], design, 0.0), rss, mask)
+    fits['hyperbolic'] = _model_fit(theta, theta[:, 0], theta[:, 1], np.full(len(theta), np.inf), covariance,
+                                    residual, mask, 2, np.ones(len(theta), dtype=bool))
+    cp_start = theta[:, 0]
+    wprime_start = np.where(theta[:, 1] > 0, theta[:, 1], 1e4)
+
+    # both three parameter models start from the hyperbolic fit
+    max_power = np.max(np.where(mask, power, -np.inf), axis=1)
+    min_duration = np.min(np.where(mask, duration, np.inf), axis=1)
+    pmax_start = np.maximum(2 * max_power, cp_start + 1)
+
+    start = np.column_stack([cp_start, wprime_start, wprime_start / (pmax_start - cp_start)])
+    theta, jacobian, converged = _levenberg_marquardt(_three_parameter, start, duration, power, mask)
+    cp, wprime, k = theta.T
+    residual = np.where(mask, _three_parameter(theta, duration)[0] - power, 0.0)
+    covariance = _parameter_covariance(jacobian, np.sum(residual ** 2, axis=1), mask)[:, :2, :2]
+    fits['three_parameter'] = _model_fit(theta, cp, wprime, cp + wprime / k, covariance, residual, mask, 3,
+                                         converged)
+
+    power_at_shortest = np.max(np.where(mask & (duration == min_duration[:, None]), power, -np.inf), axis=1)
+    amplitude_start = np.where(power_at_shortest > cp_start, (power_at_shortest - cp_start) * np.e, 0.1 * max_power)
+    start = np.column_stack([cp_start, amplitude_start, min_duration])
+    theta, jacobian, converged = _levenberg_marquardt(_exponential, start, duration, power, mask)
+    cp, amplitude, tau = theta.T
+    residual = np.where(mask, _exponential(theta, duration)[0] - power, 0.0)
+    covariance = _parameter_covariance(jacobian, np.sum(residual ** 2, axis=1), mask)
+    # wprime is the work above cp, the integral of amplitude * exp(-t / tau)
+    gradient = np.zeros((len(theta), 2, 3))
+    gradient[:, 0, 0] = 1
+    gradient[:, 1, 1] = tau
+    gradient[:, 1, 2] = amplitude
+    fits['exponential'] = _model_fit(theta, cp, amplitude * tau, cp + amplitude,
+                                     _transform_covariance(covariance, gradient), residual, mask, 3, converged)
+    return fits
+
+
+def best_model(fits, criterion='aicc'):
+    # name of the ranked model with the lowest criterion for each row, the linear model when none can be compared
+    values = np.stack([np.where(fits[model].converged & (fits[model].cp > 0) & (fits[model].wprime > 0),
+                                getattr(fits[model], criterion), np.inf) for model in RANKED_MODELS])
+    best = np.argmin(values, axis=0)
+    best[~np.isfinite(values.min(axis=0))] = RANKED_MODELS.index('linear')
+    return [RANKED_MODELS[i] for i in best]
+
+
+def fit_table(fits, row=0):
+    # one row per model for display, with values that cannot be compared left empty
+    table = []
+    for model in MODELS:
+        fit = fits[model]
+        values = {name: float(getattr(fit, name)[row])
+                  for name in ['cp', 'wprime', 'pmax', 'rss', 'aic', 'aicc', 'bic']}
+        table.append(dict(model=model, **{name: value if np.isfinite(value) else None
+                                          for name, value in values.items()}))
+    return table
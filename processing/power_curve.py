@@ -0,0 +1,55 @@
+from collections import namedtuple
+
+import numpy as np
+
+# durations (s) of the best efforts used to fit critical power, spanning the 3 to 20 minute range
+FIT_DURATIONS = [180, 300, 600, 720, 1200]
+
+PowerCurve = namedtuple('PowerCurve', ['duration', 'power', 'start'])
+
+
+def curve_durations(length, n=200, include=FIT_DURATIONS):
+    # log-spaced durations from 1 s to the activity length, always including the fitting durations
+    if length < 1:
+        return np.zeros(0, dtype=np.int64)
+    durations = np.round(np.geomspace(1, length, n))
+    durations = np.concatenate([durations, [d for d in include if d <= length]])
+    return np.unique(durations).astype(np.int64)
+
+
+def uniform_energy(index):
+    # cumulative energy on a 1 s grid, so a window of d seconds is a difference of two entries d apart. No
+    # work is done across a recording gap, so the energy is flat over a pause.
+    seconds = np.asarray(index.seconds)
+    energy = np.asarray(index.energy)
+    valid = ~np.isnan(seconds)
+    seconds, energy = seconds[valid], energy[valid]
+    if not len(seconds):
+        return np.zeros(0)
+    grid = np.arange(0, int(seconds[-1]) + 1)
+    return np.interp(grid, seconds, energy)
+
+
+def mean_maximal_power(index, durations=None):
+    energy = uniform_energy(index)
+    length = len(energy) - 1
+    if durations is None:
+        durations = curve_durations(length)
+    durations = np.asarray([d for d in durations if 0 < d <= length], dtype=np.int64)
+
+    power = np.empty(len(durations))
+    start = np.empty(len(durations), dtype=np.int64)
+    for i, duration in enumerate(durations):
+        work = energy[duration:] - energy[:-duration]
+        start[i] = np.argmax(work)
+        power[i] = work[start[i]] / duration
+    return PowerCurve(duration=durations, power=power, start=start)
+
+
+def best_efforts(index, durations=FIT_DURATIONS):
+    # [start, stop) sample spans of the best effort for each duration that fits in the activity
+    curve = mean_maximal_power(index, durations)
+    seconds = np.asarray(index.seconds)
+    first = np.searchsorted(seconds, curve.start, side='left')
+    last = np.searchsorted(seconds, curve.start + curve.duration, side='right')
+    return list(zip(first.tolist(), last.tolist()))
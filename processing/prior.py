@@ -0,0 +1,140 @@
+import os
+import hashlib
+import tempfile
+import threading
+from functools import lru_cache
+from collections import namedtuple
+
+import numpy as np
+
+from processing.critical_power import DEFAULT_PRIOR, Prior
+from processing.sampler import DEFAULT_BOUNDS, Bounds
+
+# Critical power prior from a race result (weight in kg, distance in m, time in s), following
+# examples/cp_prior.py: the race velocity is extended to an hour with a fatigue factor and converted to
+# power with a running cost and air resistance. The factors are drawn uniformly from their ranges.
+AIR_DENSITY = 1.225
+MAX_WATTS_PER_KG = 6.4  # limit of human power
+FATIGUE_FACTOR = (1.05, 1.08)  # how much a runner's velocity decreases as race distance increases
+RUNNING_COST = (0.88, 1.08)  # specific energy cost of running (related to running economy)
+CDA = (0.2, 0.24)  # coefficient of drag times area
+N_SAMPLES = 2048
+# the prior is never tighter than this, as where every draw is at the power limit (W)
+MIN_CP_SD = 10
+
+# the prior is interpolated from this grid, distance and time on log scales
+GRID_WEIGHTS = np.linspace(40, 120, 17)
+GRID_DISTANCES = np.geomspace(800, 42195, 25)
+GRID_TIMES = np.geomspace(90, 6 * 3600, 40)
+
+PRIOR_DIR = os.environ.get('CPZONES_PRIOR_DIR', os.path.join(tempfile.gettempdir(), 'cpzones-prior'))
+
+# cp mean, sd and the 1% and 99% quantiles, (n_weights, n_distances, n_times) each
+PriorGrid = namedtuple('PriorGrid', ['weight', 'distance', 'time', 'cp_mean', 'cp_sd', 'cp_lower', 'cp_upper'])
+
+# held while the grid is built or loaded, so threads of a worker that all miss the cache build it once
+_grid_lock = threading.Lock()
+
+
+def parameter_samples(n=N_SAMPLES, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(*FATIGUE_FACTOR, n), rng.uniform(*RUNNING_COST, n), rng.uniform(*CDA, n))
+
+
+def simulate_cp(weight, distance, time, samples=None):
+    # cp samples for every race, the last axis are the Monte Carlo draws
+    fatigue_factor, running_cost, cda = parameter_samples() if samples is None else samples
+    weight, distance, time = [np.asarray(value, dtype=np.float64)[..., None] for value in (weight, distance, time)]
+    velocity = (3600 / time) ** (1 / fatigue_factor) * distance / 3600
+    power = running_cost * velocity * weight + 0.5 * AIR_DENSITY * cda * velocity ** 3
+    return np.minimum(power, MAX_WATTS_PER_KG * weight)
+
+
+def _grid_tag():
+    values = np.concatenate([GRID_WEIGHTS, GRID_DISTANCES, GRID_TIMES, FATIGUE_FACTOR, RUNNING_COST, CDA,
+                             [AIR_DENSITY, MAX_WATTS_PER_KG, N_SAMPLES]])
+    return hashlib.blake2b(values.tobytes(), digest_size=4).hexdigest()
+
+
+def build_prior_grid():
+    samples = parameter_samples()
+    distance, time = np.meshgrid(GRID_DISTANCES, GRID_TIMES, indexing='ij')
+    statistics = []
+    # one weight at a time keeps the draws at n_distances * n_times * N_SAMPLES
+    for weight in GRID_WEIGHTS:
+        cp = simulate_cp(weight, distance, time, samples)
+        lower, upper = np.percentile(cp, [1, 99], axis=-1)
+        statistics.append((cp.mean(axis=-1), cp.std(axis=-1), lower, upper))
+    cp_mean, cp_sd, cp_lower, cp_upper = [np.stack(values) for values in zip(*statistics)]
+    return PriorGrid(GRID_WEIGHTS, GRID_DISTANCES, GRID_TIMES, cp_mean, cp_sd, cp_lower, cp_upper)
+
+
+@lru_cache(maxsize=1)
+def prior_grid(cache_dir=PRIOR_DIR):
+    # built once per process and kept on disk, so workers and restarts only load it
+    path = os.path.join(cache_dir, 'prior-{}.npz'.format(_grid_tag())) if cache_dir else None
+    with _grid_lock:
+        if path and os.path.exists(path):
+            with np.load(path) as cached:
+                return PriorGrid(**{field: cached[field] for field in PriorGrid._fields})
+        grid = build_prior_grid()
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary_path = '{}.{}.tmp.npz'.format(path[:-4], os.getpid())
+            np.savez(temporary_path, **grid._asdict())
+            os.replace(temporary_path, path)
+        return grid
+
+
+def _axis_position(axis, values):
+    # lower grid index and fraction towards the next point, clamped to the grid
+    values = np.clip(values, axis[0], axis[-1])
+    index = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+    return index, (values - axis[index]) / (axis[index + 1] - axis[index])
+
+
+def interpolate(grid, field, weight, distance, time):
+    # trilinear interpolation of a grid field, in weight, log distance and log time
+    positions = [_axis_position(axis, values) for axis, values in [
+        (grid.weight, np.asarray(weight, dtype=np.float64)),
+        (np.log(grid.distance), np.log(np.asarray(distance, dtype=np.float64))),
+        (np.log(grid.time), np.log(np.asarray(time, dtype=np.float64)))]]
+    (i, fi), (j, fj), (k, fk) = positions
+    values = getattr(grid, field)
+    result = 0
+    for di, wi in [(0, 1 - fi), (1, fi)]:
+        for dj, wj in [(0, 1 - fj), (1, fj)]:
+            for dk, wk in [(0, 1 - fk), (1, fk)]:
+                result = result + wi * wj * wk * values[i + di, j + dj, k + dk]
+    return result
+
+
+def in_grid(grid, weight, distance, time):
+    return all(axis[0] <= value <= axis[-1] for axis, value in
+               [(grid.weight, weight), (grid.distance, distance), (grid.time, time)])
+
+
+def race_statistics(weight, distance, time):
+    # cp mean, sd and 1% and 99% quantiles of one race, interpolated from the grid inside it and simulated
+    # directly outside, where interpolation would clamp the race to the edge of the grid
+    grid = prior_grid()
+    if in_grid(grid, weight, distance, time):
+        return [float(interpolate(grid, field, weight, distance, time))
+                for field in ['cp_mean', 'cp_sd', 'cp_lower', 'cp_upper']]
+    cp = simulate_cp(weight, distance, time)
+    lower, upper = np.percentile(cp, [1, 99])
+    return [float(cp.mean()), float(cp.std()), float(lower), float(upper)]
+
+
+def race_prior(weight, distance, time):
+    # Gaussian prior on cp for an athlete's race, with the default prior on W'
+    cp_mean, cp_sd, _, _ = race_statistics(weight, distance, time)
+    return Prior(cp_mean=cp_mean, cp_sd=max(cp_sd, MIN_CP_SD),
+                 wprime_mean=DEFAULT_PRIOR.wprime_mean, wprime_sd=DEFAULT_PRIOR.wprime_sd)
+
+
+def race_bounds(weight, distance, time):
+    # sampler bounds on cp for an athlete's race, at least as wide as the prior, with the default bounds on W'
+    cp_mean, _, cp_lower, cp_upper = race_statistics(weight, distance, time)
+    return Bounds(cp_lower=min(cp_lower, cp_mean - 3 * MIN_CP_SD), cp_upper=max(cp_upper, cp_mean + 3 * MIN_CP_SD),
+                  wprime_lower=DEFAULT_BOUNDS.wprime_lower, wprime_upper=DEFAULT_BOUNDS.wprime_upper)
@@ -0,0 +1,96 @@
+from collections import namedtuple
+
+import numpy as np
+
+from processing.fit import FIT_EPOCH, FitData, compact, decode_fit
+
+RESAMPLE_INTERVAL = 1  # seconds between samples of the uniform grid
+# samples further apart than this are a recording gap (pause, auto-pause, dropout) and are not
+# interpolated across; smart recording stores a sample every 1-8 s
+MAX_GAP = 10
+INTERPOLATION = 'linear'  # or 'previous' to hold each recorded value until the next
+# FIT timestamps below this are seconds since the device was switched on, written before it has the time
+MIN_FIT_TIMESTAMP = 0x10000000
+# samples more than half of this from the median timestamp are dropped as bad timestamps
+MAX_SPAN = 48 * 3600
+
+# True at grid samples inside a recording gap
+Gaps = namedtuple('Gaps', ['gap'])
+
+
+def _brackets(t, grid, max_gap):
+    # for each grid point the last recorded sample at or before it, whether it is exactly on that sample,
+    # and whether it can be interpolated to the next sample
+    before = np.searchsorted(t, grid, side='right') - 1
+    after = np.minimum(before + 1, len(t) - 1)
+    safe = np.maximum(before, 0)
+    exact = (before >= 0) & (t[safe] == grid)
+    inside = (before >= 0) & (before + 1 < len(t)) & (t[after] - t[safe] <= max_gap)
+    return safe, after, exact, inside
+
+
+def _interpolate(t, values, grid, max_gap, method):
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    resampled = np.full(len(grid), np.nan)
+    if not valid.any():
+        return resampled
+    t, values = t[valid], values[valid]
+    before, after, exact, inside = _brackets(t, grid, max_gap)
+    if method == 'previous':
+        between = values[before]
+    else:
+        span = np.maximum(t[after] - t[before], 1)
+        between = values[before] + (values[after] - values[before]) * (grid - t[before]) / span
+    resampled[inside] = between[inside]
+    resampled[exact] = values[before[exact]]
+    return resampled
+
+
+def _grid(t, interval, max_gap):
+    # a uniform grid over each run of samples no further apart than max_gap, and a single sample after each
+    # run, so the size of the grid is bounded by the number of samples however long the pauses are
+    breaks = np.flatnonzero(np.diff(t) > max_gap)
+    starts = t[np.concatenate([[0], breaks + 1])]
+    stops = t[np.concatenate([breaks, [len(t) - 1]])]
+    lengths = (stops - starts) // interval + 1
+    lengths[:-1] += 1
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets * interval
+
+
+def resample(data, interval=RESAMPLE_INTERVAL, max_gap=MAX_GAP, method=INTERPOLATION):
+    # every channel on a grid of uniform steps from the first to the last timestamp, except that a recording
+    # gap is a single grid sample. Grid samples in gaps are NaN in every channel and marked in the returned
+    # gap mask. Each channel is interpolated over its own valid samples, so short sensor dropouts are filled too.
+    time = np.asarray(data.time, dtype='datetime64[s]')
+    recorded = np.flatnonzero(~np.isnat(time))
+    seconds = time[recorded].astype(np.int64)
+    plausible = seconds >= FIT_EPOCH + MIN_FIT_TIMESTAMP
+    if plausible.any():
+        # the lower median is one of the samples, so at least its part of the activity is kept
+        middle = np.sort(seconds[plausible])[(plausible.sum() - 1) // 2]
+        plausible &= np.abs(seconds - middle) <= MAX_SPAN / 2
+    recorded, seconds = recorded[plausible], seconds[plausible]
+    if not len(recorded):
+        empty = compact(FitData(time=time[:0], **{field: np.zeros(0) for field in FitData._fields[1:]}))
+        return empty, Gaps(np.zeros(0, dtype=bool))
+    # sorted, keeping the first sample of any repeated timestamp
+    order = np.argsort(seconds, kind='stable')
+    t, first = np.unique(seconds[order], return_index=True)
+    keep = recorded[order[first]]
+
+    grid = _grid(t, interval, max_gap)
+    _, _, exact, inside = _brackets(t, grid, max_gap)
+    gap = ~(exact | inside)
+    channels = {}
+    for field in FitData._fields[1:]:
+        values = _interpolate(t, np.asarray(getattr(data, field))[keep], grid, max_gap, method)
+        values[gap] = np.nan
+        channels[field] = values
+    return compact(FitData(time=grid.astype('datetime64[s]'), **channels)), Gaps(gap)
+
+
+def read_fit(buffer):
+    # parse a .fit file onto the uniform grid every statistic is computed from
+    return resample(decode_fit(buffer))
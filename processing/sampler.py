@@ -0,0 +1,125 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from processing.critical_power import ENERGY_ERROR
+
+# uniform prior box on (cp, wprime)
+Bounds = namedtuple('Bounds', ['cp_lower', 'cp_upper', 'wprime_lower', 'wprime_upper'])
+DEFAULT_BOUNDS = Bounds(cp_lower=50, cp_upper=600, wprime_lower=1000, wprime_upper=60000)
+
+SamplerResult = namedtuple('SamplerResult', ['samples', 'autocorrelation_time', 'effective_samples', 'r_hat',
+                                             'converged', 'steps'])
+# 5%, median and 95% of each parameter
+SampleSummary = namedtuple('SampleSummary', ['cp', 'wprime', 'r_hat', 'converged'])
+
+
+def log_prior(theta, bounds=DEFAULT_BOUNDS):
+    # theta is (n_walkers, 2) of (cp, wprime)
+    cp, wprime = theta[:, 0], theta[:, 1]
+    inside = ((cp > bounds.cp_lower) & (cp < bounds.cp_upper) &
+              (wprime > bounds.wprime_lower) & (wprime < bounds.wprime_upper))
+    return np.where(inside, 0.0, -np.inf)
+
+
+def log_likelihood(theta, duration, energy, energy_error=ENERGY_ERROR):
+    model = theta[:, 0:1] * duration + theta[:, 1:2]
+    # intervals without work have no relative error and are left out, as in critical_power_posterior
+    valid = energy > 0
+    error = energy_error * np.where(valid, energy, 1)
+    return -0.5 * np.sum(np.where(valid, (model - energy) / error, 0) ** 2, axis=1)
+
+
+def log_posterior(theta, duration, energy, bounds=DEFAULT_BOUNDS, energy_error=ENERGY_ERROR):
+    prior = log_prior(theta, bounds)
+    inside = np.isfinite(prior)
+    posterior = np.full(len(theta), -np.inf)
+    posterior[inside] = log_likelihood(theta[inside], duration, energy, energy_error)
+    return posterior
+
+
+def _run_chain(seed, duration, energy, bounds, energy_error, n_walkers, max_steps, check_interval, tau_tolerance,
+               progress=None):
+    # one ensemble run until the autocorrelation time is stable to tau_tolerance and short compared to the chain
+    # emcee imports scipy.stats, which the web app should not pay for until a job samples
+    import emcee
+
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(low=[bounds.cp_lower, bounds.wprime_lower], high=[bounds.cp_upper, bounds.wprime_upper],
+                        size=(n_walkers, 2))
+    sampler = emcee.EnsembleSampler(n_walkers, 2, log_posterior, args=(duration, energy, bounds, energy_error),
+                                    vectorize=True)
+    sampler.random_state = np.random.RandomState(seed).get_state()
+
+    tau = np.full(2, np.inf)
+    converged = False
+    for _ in sampler.sample(start, iterations=max_steps, progress=False):
+        if sampler.iteration % check_interval:
+            continue
+        if progress:
+            progress(sampler.iteration / max_steps)
+        new_tau = sampler.get_autocorr_time(tol=0)
+        converged = np.all(50 * new_tau < sampler.iteration) and np.all(np.abs(tau - new_tau) < tau_tolerance * new_tau)
+        tau = new_tau
+        if converged:
+            break
+
+    tau = sampler.get_autocorr_time(tol=0)
+    burn = int(2 * np.max(tau))
+    thin = max(1, int(0.5 * np.min(tau)))
+    return sampler.get_chain(discard=burn, thin=thin), tau, converged, sampler.iteration, sampler.iteration - burn
+
+
+def gelman_rubin(chains):
+    # potential scale reduction of each parameter over chains of shape (n_chains, n_samples, n_parameters)
+    n = chains.shape[1]
+    within = chains.var(axis=1, ddof=1).mean(axis=0)
+    between = n * chains.mean(axis=1).var(axis=0, ddof=1)
+    return np.sqrt(((n - 1) / n * within + between / n) / within)
+
+
+def sample_critical_power(duration, energy, bounds=DEFAULT_BOUNDS, energy_error=ENERGY_ERROR, n_chains=4,
+                          n_walkers=32, max_steps=20000, check_interval=500, tau_tolerance=0.01, processes=None,
+                          seed=0, progress=None):
+    # posterior samples of (cp, wprime) from independent vectorized ensembles run in parallel
+    duration = np.asarray(duration, dtype=np.float64)
+    energy = np.asarray(energy, dtype=np.float64)
+    arguments = (duration, energy, bounds, energy_error, n_walkers, max_steps, check_interval, tau_tolerance)
+    seeds = np.random.SeedSequence(seed).generate_state(n_chains).tolist()
+    runs = []
+    if processes == 1:
+        for i, chain_seed in enumerate(seeds):
+            chain_progress = (lambda fraction, i=i: progress((i + fraction) / n_chains)) if progress else None
+            runs.append(_run_chain(chain_seed, *arguments, progress=chain_progress))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for run in pool.map(_run_chain, seeds, *[[argument] * n_chains for argument in arguments]):
+                runs.append(run)
+                if progress:
+                    progress(len(runs) / n_chains)
+
+    # chains can stop at different lengths, compare them over their common length
+    length = min(len(run[0]) for run in runs)
+    chains = np.stack([run[0][-length:].transpose(1, 0, 2).reshape(-1, 2) for run in runs])
+    tau = np.max([run[1] for run in runs], axis=0)
+    samples = np.concatenate([run[0].reshape(-1, 2) for run in runs])
+    # only the steps after each run's burn-in are samples
+    kept_steps = sum(run[4] for run in runs)
+    return SamplerResult(samples=samples,
+                         autocorrelation_time=tau,
+                         effective_samples=kept_steps * n_walkers / tau,
+                         r_hat=gelman_rubin(chains),
+                         converged=all(run[2] for run in runs),
+                         steps=sum(run[3] for run in runs))
+
+
+def sample_summary(duration, energy, bounds=DEFAULT_BOUNDS, progress=None):
+    # sampler run in the calling process, reduced to percentiles small enough to keep as a job result. The
+    # 5%, 50% and 95% of this two parameter, near Gaussian posterior need far fewer samples than the defaults
+    # give: two chains still give R-hat, and a looser stopping rule leaves thousands of effective samples
+    # at about a seventh of the cost.
+    result = sample_critical_power(duration, energy, bounds, n_chains=2, check_interval=250, tau_tolerance=0.1,
+                                   processes=1, progress=progress)
+    cp, wprime = np.percentile(result.samples, [5, 50, 95], axis=0).T
+    return SampleSummary(cp=tuple(cp), wprime=tuple(wprime), r_hat=tuple(result.r_hat), converged=result.converged)
@@ -0,0 +1,78 @@
+import heapq
+
+import numpy as np
+
+MIN_SEGMENT_SECONDS = 60
+MAX_INTERVALS = 8
+# scales the BIC-like penalty, noise variance * log(n), that a split must beat
+PENALTY_FACTOR = 20
+
+
+def _forward_fill(values):
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return np.zeros(len(values))
+    last = np.maximum.accumulate(np.where(valid, np.arange(len(values)), 0))
+    filled = values[last]
+    filled[:np.argmax(valid)] = values[valid][0]
+    return filled
+
+
+def noise_variance(values):
+    # robust variance of sample to sample noise from the median absolute difference
+    sigma = np.median(np.abs(np.diff(values))) / (0.6745 * np.sqrt(2))
+    return max(sigma ** 2, 1.0)
+
+
+def binary_segmentation(values, penalty, min_length):
+    # change points in the mean of values, splitting the segment with the largest gain first until no
+    # split reduces the squared error by more than penalty. Prefix sums make every candidate split of a
+    # segment one vectorized expression, so the whole search is O(n log n).
+    values = np.asarray(values, dtype=np.float64)
+    total = np.concatenate([[0], np.cumsum(values)])
+
+    def best_split(start, stop):
+        if stop - start < 2 * min_length:
+            return None
+        split = np.arange(start + min_length, stop - min_length + 1)
+        left, right = total[split] - total[start], total[stop] - total[split]
+        gain = (left ** 2 / (split - start) + right ** 2 / (stop - split) -
+                (total[stop] - total[start]) ** 2 / (stop - start))
+        best = int(np.argmax(gain))
+        return -gain[best], start, stop, int(split[best])
+
+    heap = [candidate for candidate in [best_split(0, len(values))] if candidate]
+    change_points = []
+    while heap:
+        negative_gain, start, stop, split = heapq.heappop(heap)
+        if -negative_gain <= penalty:
+            break
+        change_points.append(split)
+        for candidate in (best_split(start, split), best_split(split, stop)):
+            if candidate:
+                heapq.heappush(heap, candidate)
+    return [0] + sorted(change_points) + [len(values)]
+
+
+def detect_intervals(data, index, gaps=None, max_intervals=MAX_INTERVALS, min_seconds=MIN_SEGMENT_SECONDS,
+                     penalty_factor=PENALTY_FACTOR):
+    # [start, stop) spans of the hardest steady efforts: the segments of constant mean power with the
+    # highest mean, as long as that is above the mean of the whole activity. Sensor dropouts hold the
+    # last power, recording gaps are stopped so efforts do not run across a pause.
+    power = _forward_fill(data.power)
+    if gaps is not None:
+        power[np.asarray(gaps.gap)] = 0
+    if len(power) < 2:
+        return []
+    sample_seconds = max(float(np.median(np.diff(index.seconds))), 1e-3)
+    min_length = max(int(min_seconds / sample_seconds), 1)
+    penalty = penalty_factor * noise_variance(power) * np.log(len(power))
+    boundaries = binary_segmentation(power, penalty, min_length)
+
+    starts, stops = np.array(boundaries[:-1]), np.array(boundaries[1:])
+    total = np.concatenate([[0], np.cumsum(power)])
+    mean = (total[stops] - total[starts]) / (stops - starts)
+    hard = np.flatnonzero(mean > power.mean())
+    hardest = hard[np.argsort(-mean[hard])][:max_intervals]
+    return sorted(zip(starts[hardest].tolist(), stops[hardest].tolist()))
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from processing.fit import FitData
+
+STORE_DIR = os.environ.get('CPZONES_STORE_DIR', os.path.join(tempfile.gettempdir(), 'cpzones-store'))
+STORE_BYTES = int(os.environ.get('CPZONES_STORE_BYTES', 2 ** 30))
+
+
+class ActivityStore:
+    # File-backed store of parsed activities shared by every worker on the host.
+    # Each activity is a directory of .npy files, one per field of the records stored with it
+    # (FitData and anything derived from it at upload), opened memory-mapped so workers reading
+    # the same activity share pages. Least recently used activities are removed once the
+    # directory grows past max_bytes.
+
+    def __init__(self, directory=STORE_DIR, max_bytes=STORE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __contains__(self, key):
+        try:
+            return os.path.isdir(self._path(key))
+        except ValueError:
+            return False
+
+    def get(self, key, record=FitData):
+        try:
+            path = self._path(key)
+            data = record(**{field: np.load(os.path.join(path, field + '.npy'), mmap_mode='r')
+                             for field in record._fields})
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def touch(self, key):
+        # mark an activity as recently used, False when it is not stored
+        try:
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def put(self, key, *records):
+        path = self._path(key)
+        if os.path.isdir(path):
+            os.utime(path)
+            return
+        temporary_path = tempfile.mkdtemp(prefix='.' + key, dir=self.directory)
+        for record in records:
+            for field, values in record._asdict().items():
+                np.save(os.path.join(temporary_path, field + '.npy'), np.asarray(values))
+        try:
+            os.rename(temporary_path, path)
+        except OSError:
+            # another worker stored the same activity first
+            shutil.rmtree(temporary_path, ignore_errors=True)
+        self._evict()
+
+    def _path(self, key):
+        if not key or os.sep in key or key.startswith('.'):
+            raise ValueError('invalid activity key')
+        return os.path.join(self.directory, key)
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith('.') or not entry.is_dir():
+                    continue
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries)[:-1]:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+
+activity_store = ActivityStore()
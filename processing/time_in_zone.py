@@ -0,0 +1,82 @@
+from collections import namedtuple
+
+import numpy as np
+
+from processing.critical_power import ZONES, ZONE_LOWER
+
+ZONE_NAMES = ['below Z1'] + ZONES
+# longer gaps between samples are pauses and are not counted as time in any zone
+MAX_SAMPLE_INTERVAL = 5
+
+# (n_groups, len(ZONE_NAMES)) arrays of seconds, joules and time-weighted km/h
+ZoneDistribution = namedtuple('ZoneDistribution', ['time', 'energy', 'speed'])
+
+
+def sample_intervals(time):
+    # seconds each sample stands for, the time since the previous sample
+    seconds = (np.asarray(time) - time[0]) / np.timedelta64(1, 's') if len(time) else np.zeros(0)
+    interval = np.zeros(len(seconds))
+    interval[1:] = np.diff(seconds)
+    interval[interval > MAX_SAMPLE_INTERVAL] = 0
+    return interval
+
+
+def week_start(time):
+    # monday of the week of a datetime64, numpy weeks start on thursdays
+    day = np.datetime64(time, 'D')
+    return day - np.timedelta64((day.astype(np.int64) + 3) % 7, 'D')
+
+
+def zone_distribution(activities, cp, groups=None):
+    # time, energy and average speed in each zone, for every activity or for groups of activities
+    # (groups[i] is the group of activities[i]), with all samples binned in one pass. Zones are
+    # fractions of cp, which may differ per activity; power above Z5 counts as Z5.
+    n_activities = len(activities)
+    cp = np.broadcast_to(np.asarray(cp, dtype=np.float64), (n_activities,))
+    groups = np.arange(n_activities) if groups is None else np.asarray(groups)
+    n_groups = int(groups.max()) + 1 if n_activities else 0
+    n_zones = len(ZONE_NAMES)
+
+    lengths = [len(activity.power) for activity in activities]
+    sample_group = np.repeat(groups, lengths)
+    power = np.concatenate([np.asarray(activity.power, dtype=np.float64) for activity in activities] or [[]])
+    speed = np.concatenate([np.asarray(activity.speed, dtype=np.float64) for activity in activities] or [[]])
+    interval = np.concatenate([sample_intervals(activity.time) for activity in activities] or [[]])
+
+    zone = np.minimum(np.searchsorted(ZONE_LOWER, power / np.repeat(cp, lengths), side='right'), n_zones - 1)
+    bins = sample_group * n_zones + zone
+    valid = ~np.isnan(power)
+    with_speed = valid & ~np.isnan(speed)
+
+    def binned(weights):
+        return np.bincount(bins, weights=weights, minlength=n_groups * n_zones).reshape(n_groups, n_zones)
+
+    time = binned(np.where(valid, interval, 0))
+    energy = binned(np.where(valid, power * interval, 0))
+    speed_time = binned(np.where(with_speed, interval, 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_speed = binned(np.where(with_speed, speed * interval, 0)) / speed_time
+    return ZoneDistribution(time=time, energy=energy, speed=average_speed)
+
+
+def weekly_zone_distribution(activities, cp):
+    # zone distribution summed over the activities starting in each week
+    starts = np.array([week_start(activity.time[0]) for activity in activities], dtype='datetime64[D]')
+    weeks, groups = np.unique(starts, return_inverse=True)
+    return weeks, zone_distribution(activities, cp, groups)
+
+
+def activity_zones(power_zones_df, data, cp):
+    # the zones table with how long, how much work and how fast the activity was in each zone
+    import pandas as pd
+
+    distribution = zone_distribution([data], cp)
+    below = power_zones_df.iloc[:1].copy()
+    below[:] = np.nan
+    below['zone'], below['description'] = ZONE_NAMES[0], 'Recovery'
+    below['lower power'], below['upper power'] = 0, power_zones_df['lower power'].iloc[0]
+    table = pd.concat([below, power_zones_df], ignore_index=True)
+    table['time in zone'] = distribution.time[0] / 60
+    table['energy in zone'] = distribution.energy[0] / 1000
+    table['average speed in zone'] = distribution.speed[0]
+    return table
@@ -0,0 +1,41 @@
+import os
+import binascii
+
+from processing.fit import check_header
+
+MAX_UPLOAD_BYTES = 32 * 2 ** 20
+# largest request the server accepts: an upload as base64 plus room for the other callback inputs
+MAX_REQUEST_BYTES = (MAX_UPLOAD_BYTES + 2) // 3 * 4 + 2 ** 20
+CHUNK_CHARACTERS = 2 ** 18  # base64 characters decoded per step, a multiple of 4
+ALLOWED_EXTENSIONS = ('.fit',)
+
+
+def decoded_size(contents, start=0):
+    encoded_length = len(contents) - start
+    if encoded_length % 4:
+        raise ValueError('invalid base64 payload')
+    padding = contents.count('=', max(start, len(contents) - 2))
+    return encoded_length // 4 * 3 - padding
+
+
+def decode_upload(contents, filename, max_bytes=MAX_UPLOAD_BYTES):
+    # decode a dcc.Upload data url into a single buffer, rejecting bad files as early as possible
+    if os.path.splitext(filename or '')[1].lower() not in ALLOWED_EXTENSIONS:
+        raise ValueError('unsupported file type: {}'.format(filename))
+    start = contents.index(',') + 1
+    size = decoded_size(contents, start)
+    if size > max_bytes:
+        raise ValueError('file is larger than {} bytes'.format(max_bytes))
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    offset = 0
+    for chunk_start in range(start, len(contents), CHUNK_CHARACTERS):
+        chunk = binascii.a2b_base64(contents[chunk_start:chunk_start + CHUNK_CHARACTERS])
+        view[offset:offset + len(chunk)] = chunk
+        if offset == 0:
+            check_header(view[:len(chunk)])
+        offset += len(chunk)
+    if offset != size:
+        raise ValueError('invalid base64 payload')
+    return view
@@ -0,0 +1,41 @@
+import numpy as np
+
+from processing.intervals import sample_durations
+
+# largest exponent used inside one cumulative sum, exp(500) is far from float64 overflow
+MAX_EXPONENT = 500
+
+
+def recovery_time_constant(power, cp):
+    # Skiba et al. (2012): tau = 546 exp(-0.01 D_CP) + 316, D_CP the mean shortfall below cp while recovering
+    power = np.asarray(power, dtype=np.float64)
+    below = power[power < cp]
+    d_cp = cp - below.mean() if len(below) else 0
+    return 546 * np.exp(-0.01 * d_cp) + 316
+
+
+def wprime_balance(seconds, power, cp, wprime, tau=None):
+    # Skiba integral model, W'bal(t) = W' - sum over u <= t of W'exp(u) exp(-(t - u) / tau). Written as
+    # exp(-t / tau) * cumsum(W'exp(u) exp(u / tau)) it is linear in the samples; the series is cut into
+    # chunks MAX_EXPONENT * tau seconds long so the exponentials stay in range, carrying the balance over.
+    seconds = np.asarray(seconds, dtype=np.float64)
+    if tau is None:
+        tau = recovery_time_constant(power, cp)
+    power = np.nan_to_num(np.asarray(power, dtype=np.float64))
+
+    expended = sample_durations(seconds) * np.maximum(power - cp, 0)
+
+    used = np.zeros(len(power))
+    if not len(power):
+        return used
+    chunk_starts = np.arange(seconds[0], seconds[-1] + 1, MAX_EXPONENT * tau)
+    boundaries = np.append(np.searchsorted(seconds, chunk_starts), len(seconds))
+    carry, carry_time = 0.0, seconds[0]
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        if stop <= start:
+            continue
+        local = (seconds[start:stop] - seconds[start]) / tau
+        carried = carry * np.exp(-(seconds[start] - carry_time) / tau)
+        used[start:stop] = np.exp(-local) * (np.cumsum(expended[start:stop] * np.exp(local)) + carried)
+        carry, carry_time = used[stop - 1], seconds[stop - 1]
+    return wprime - used